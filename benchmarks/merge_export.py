@@ -0,0 +1,49 @@
+'''
+Benchmark for the export profiles of the automated merge (merge/export_profiles.py)
+
+Writes a chip layout with each export profile, and reports the write
+time, the file size, and the time to read the file back (as downstream
+tools and the checks do).
+
+Usage:
+  python merge/EBeam_merge.py
+  python benchmarks/merge_export.py
+  python benchmarks/merge_export.py /tmp/synthetic/EBeam.oas --repeat 3
+
+'''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(path, '..', 'merge'))
+from export_profiles import export_chip, export_profiles
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the export profiles of the merged chip')
+    parser.add_argument('file', nargs='?', default=os.path.join(path, '..', 'merge', 'EBeam.oas'), help='chip layout')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    layout = pya.Layout()
+    layout.read(args.file)
+    folder = tempfile.mkdtemp()
+
+    print('%-10s %10s %10s %10s' % ('profile', 'write s', 'MB', 'read s'))
+    for profile in export_profiles:
+        t_write, t_read = 0, 0
+        for i in range(args.repeat):
+            file_out, stats = export_chip(layout.top_cell(), folder, 'EBeam', profile)
+            t_write += stats['seconds']
+            start_time = time.time()
+            pya.Layout().read(file_out)
+            t_read += time.time() - start_time
+        print('%-10s %10.2f %10.2f %10.2f' % (profile, t_write / args.repeat, stats['bytes'] / 1e6, t_read / args.repeat))
+    shutil.rmtree(folder)
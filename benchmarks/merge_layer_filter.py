@@ -0,0 +1,97 @@
+'''
+Benchmark for reading the submissions in the automated merge (merge/EBeam_merge.py)
+
+Compares, for each file in submissions/:
+ - delete: read all the layers, then delete the layers not in layers_keep
+   (the previous approach)
+ - filter: only read the layers in layers_keep, using a layer map
+   (normalize.layers_keep_options, as used in EBeam_merge.py for the GDS
+   files; the OASIS files are read with delete, which names the layers
+   deleted, for a smaller gain)
+
+With --extra-shapes N, a copy of each file is made with N additional boxes
+on a layer that is not kept (e.g., documentation), to show the effect of
+large unused layers.
+
+Usage:
+  python benchmarks/merge_layer_filter.py
+  python benchmarks/merge_layer_filter.py --extra-shapes 200000
+
+'''
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(path, '..', 'merge'))
+from normalize import layers_keep_options
+
+layers_keep = ['1/0','1/10', '68/0', '81/0', '10/0', '99/0', '26/0', '31/0', '32/0', '33/0', '998/0']
+
+
+def read_delete(f):
+    layout2 = pya.Layout()
+    layout2.read(f)
+    for li in layout2.layer_infos():
+        if li.to_s() not in layers_keep:
+            layout2.delete_layer(layout2.find_layer(li))
+    return layout2
+
+
+def read_filter(f):
+    layout2 = pya.Layout()
+    layout2.read(f, layers_keep_options(layers_keep))
+    return layout2
+
+
+def shape_count(layout2):
+    return sum(layout2.cell(c).shapes(li).size() for c in range(layout2.cells()) for li in layout2.layer_indexes())
+
+
+def with_extra_shapes(f, n, folder):
+    '''Copy of file f with n boxes added on layer 200/0'''
+    layout2 = pya.Layout()
+    layout2.read(f)
+    shapes = layout2.top_cell().shapes(layout2.layer(200, 0))
+    for i in range(n):
+        shapes.insert(pya.Box(0, 0, 100 + i % 1000, 100 + i // 1000))
+    file_out = os.path.join(folder, os.path.basename(f))
+    layout2.write(file_out)
+    return file_out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark reading the submissions with a layer filter')
+    parser.add_argument('--extra-shapes', type=int, default=0, help='number of boxes added on a layer that is not kept')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(path, '..', 'submissions', '*.gds')) + glob.glob(os.path.join(path, '..', 'submissions', '*.oas')))
+    folder = tempfile.mkdtemp()
+    if args.extra_shapes:
+        files = [with_extra_shapes(f, args.extra_shapes, folder) for f in files]
+
+    print('%-50s %10s %10s %10s %10s' % ('file', 'delete ms', 'filter ms', 'shapes', 'skipped'))
+    total = [0, 0]
+    for f in files:
+        times = []
+        for method in [read_delete, read_filter]:
+            start_time = time.time()
+            for i in range(args.repeat):
+                layout2 = method(f)
+            times.append(1e3 * (time.time() - start_time) / args.repeat)
+        layout_all = pya.Layout()
+        layout_all.read(f)
+        n_kept = shape_count(layout2)
+        print('%-50s %10.1f %10.1f %10s %10s' % (os.path.basename(f)[:50], times[0], times[1], n_kept, shape_count(layout_all) - n_kept))
+        total[0] += times[0]
+        total[1] += times[1]
+    print('%-50s %10.1f %10.1f' % ('total', total[0], total[1]))
+    shutil.rmtree(folder)
@@ -0,0 +1,151 @@
+'''
+Benchmark for the packing of the submissions on the chip (merge/placement.py)
+
+Places N submissions (Floorplan boxes of random size, up to the
+605 x 410 um allocation) on the chip, around the Floorplans of the
+framework, and reports the time per submission and the chip utilization:
+ - stepping: the previous search, moving up one gap (8 um) at a time
+ - columns: find_position, as used by EBeam_merge.py, which jumps over
+   the Floorplans in the way; it must give the same positions as stepping
+ - skyline: SkylinePacking (EBeam_merge.py --packing skyline), which
+   also avoids the PCM cutouts and keeps the cells on the chip
+
+A cell is usable if it is within the chip, and clear of the PCM cutouts;
+utilization is the area of the usable cells over the chip area that is
+not taken by the framework or the cutouts.
+
+Usage:
+  python benchmarks/merge_packing.py
+  python benchmarks/merge_packing.py --sizes 100 500 1000 --stepping-max 500
+
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(path, '..', 'merge'))
+from placement import SkylinePacking, FloorplanIndex, find_position, next_position
+
+# as in EBeam_merge.py
+cell_Width = 605000
+cell_Height = 410000
+cell_Gap_Width = 8000
+cell_Gap_Height = 8000
+chip_Width = 8650000
+chip_Height2 = 8780000
+br_cutout_x, br_cutout_y = 7484000, 898000
+br_cutout2_x, br_cutout2_y = 7855000, 5063000
+tr_cutout_x = [6080e3, 6408e3]
+tr_cutout_y = [4549e3, 3148e3]
+framework_file = os.path.join(path, '..', 'framework', 'EBL_Framework_1cm_PCM_static.oas')
+
+pcm_cutouts = [pya.Box(br_cutout_x, 0, chip_Width, br_cutout_y), pya.Box(br_cutout2_x, 0, chip_Width, br_cutout2_y)] + \
+    [pya.Box(int(x), int(y), chip_Width, chip_Height2) for x, y in zip(tr_cutout_x, tr_cutout_y)]
+
+
+def framework_floorplans():
+    layout = pya.Layout()
+    layout.read(framework_file)
+    return list(pya.Region(layout.top_cell().begin_shapes_rec(layout.layer(99, 0))).each())
+
+
+def submission_sizes(n, seed=0):
+    rng = random.Random(seed)
+    return [(rng.randrange(200000, cell_Width, 1000), rng.randrange(100000, cell_Height, 1000)) for i in range(n)]
+
+
+def place_stepping(floorplans, sizes):
+    fp_index = FloorplanIndex()
+    for polygon in floorplans:
+        fp_index.insert_polygon(polygon)
+    x, y = 0, cell_Height + cell_Gap_Height
+    max_cell_Width = 0
+    positions = []
+    for width, height in sizes:
+        max_cell_Width = max(max_cell_Width, width)
+        x, y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height2, height, max_cell_Width)
+        while not fp_index.is_free(pya.Box(x, y, x + width, y + height)):
+            x, y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height2, height, max_cell_Width)
+        fp_index.insert_box(pya.Box(x, y, x + width, y + height))
+        positions.append((x, y))
+        y += height
+    return positions
+
+
+def place_columns(floorplans, sizes):
+    fp_index = FloorplanIndex()
+    for polygon in floorplans:
+        fp_index.insert_polygon(polygon)
+    x, y = 0, cell_Height + cell_Gap_Height
+    max_cell_Width = 0
+    positions = []
+    for width, height in sizes:
+        max_cell_Width = max(max_cell_Width, width)
+        x, y, max_cell_Width = find_position(fp_index, x, y, width, height, height, max_cell_Width,
+            cell_Gap_Height, cell_Gap_Width, chip_Height2)
+        fp_index.insert_box(pya.Box(x, y, x + width, y + height))
+        positions.append((x, y))
+        y += height
+    return positions
+
+
+def place_skyline(floorplans, sizes):
+    fp_index = FloorplanIndex()
+    for polygon in floorplans:
+        fp_index.insert_polygon(polygon)
+    packing = SkylinePacking(fp_index, cell_Gap_Width, cell_Gap_Height, chip_Width, chip_Height2, pcm_cutouts)
+    positions = []
+    for width, height in sizes:
+        (x, y), on_chip = packing.position(width, height)
+        fp_index.insert_box(pya.Box(x, y, x + width, y + height))
+        positions.append((x, y))
+    return positions
+
+
+def utilization(floorplans, sizes, positions):
+    '''(number of usable cells, utilization)'''
+    chip = pya.Box(0, 0, chip_Width, chip_Height2)
+    taken = pya.Region()
+    for polygon in floorplans:
+        taken.insert(polygon)
+    for box in pcm_cutouts:
+        taken.insert(box)
+    available = (pya.Region(chip) - taken).area()
+    usable, area = 0, 0
+    for (width, height), (x, y) in zip(sizes, positions):
+        box = pya.Box(x, y, x + width, y + height)
+        if box.inside(chip) and not any(box.overlaps(cutout) for cutout in pcm_cutouts):
+            usable += 1
+            area += box.area()
+    return usable, area / available
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the packing of the submissions on the chip')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000])
+    parser.add_argument('--stepping-max', type=int, default=1000, help='largest size to run with the stepping search')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    floorplans = framework_floorplans()
+    print('%6s %-10s %10s %8s %12s' % ('N', 'packing', 'ms/sub', 'usable', 'utilization'))
+    for n in args.sizes:
+        sizes = submission_sizes(n, args.seed)
+        results = {}
+        for name, method in [('stepping', place_stepping), ('columns', place_columns), ('skyline', place_skyline)]:
+            if name == 'stepping' and n > args.stepping_max:
+                continue
+            start_time = time.time()
+            positions = method(floorplans, sizes)
+            t = time.time() - start_time
+            results[name] = positions
+            usable, used = utilization(floorplans, sizes, positions)
+            print('%6s %-10s %10.3f %8s %11.1f%%' % (n, name, 1e3 * t / n, usable, 100 * used))
+        if 'stepping' in results and results['stepping'] != results['columns']:
+            sys.exit('ERROR: stepping and columns placement differ for N=%s' % n)
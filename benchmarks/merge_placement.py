@@ -0,0 +1,137 @@
+'''
+Benchmark for the placement step of the automated merge (merge/EBeam_merge.py)
+
+Places N synthetic submissions (Floorplan boxes of random size, up to the
+605 x 410 um allocation) on a chip that contains the Floorplan obstacles of
+the framework, and reports the time per submission for:
+ - indexed: FloorplanIndex, as used in EBeam_merge.py
+ - legacy: the previous approach, rebuilding a Region of every Floorplan
+   on the chip for each submission
+
+Both approaches must produce the same positions.
+
+Usage:
+  python benchmarks/merge_placement.py
+  python benchmarks/merge_placement.py --sizes 10 100 2000 --legacy-max 500
+
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+import pya
+
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(path, '..', 'merge'))
+from placement import FloorplanIndex, find_position, next_position
+
+cell_Width = 605000
+cell_Height = 410000
+cell_Gap_Width = 8000
+cell_Gap_Height = 8000
+chip_Height2 = 8780000
+framework_file = os.path.join(path, '..', 'framework', 'EBL_Framework_1cm_PCM_static.oas')
+
+
+def synthetic_chip(n, seed=0):
+    '''
+    Chip layout with the framework Floorplan shapes, and n submission cells
+    containing only a Floorplan box; the submission cells are also created
+    in a separate source layout
+    '''
+    layout = pya.Layout()
+    layout.dbu = 0.001
+    top_cell = layout.create_cell('EBeam')
+    layer_FP = layout.layer(99, 0)
+
+    # Framework Floorplan shapes, as obstacles
+    cell_framework = layout.create_cell('framework')
+    top_cell.insert(pya.CellInstArray(cell_framework.cell_index(), pya.Trans()))
+    if os.path.exists(framework_file):
+        layout2 = pya.Layout()
+        layout2.read(framework_file)
+        cell_framework.shapes(layer_FP).insert(layout2.top_cell().begin_shapes_rec(layout2.layer(99, 0)))
+
+    # Submission cells, with their bounding boxes and Floorplans known before
+    # placement, as in EBeam_merge.py where they are taken from the clipped
+    # cell in the submission's own layout
+    rng = random.Random(seed)
+    layout_src = pya.Layout()
+    cells = []
+    for i in range(n):
+        box = pya.Box(0, 0, rng.randrange(200000, cell_Width, 1000), rng.randrange(100000, cell_Height, 1000))
+        cell = layout.create_cell('submission_%s' % i)
+        cell.shapes(layer_FP).insert(box)
+        cell_src = layout_src.create_cell('submission_%s' % i)
+        cell_src.shapes(layout_src.layer(99, 0)).insert(box)
+        cells.append((cell, cell_src, box))
+    return layout, top_cell, cells, layout_src
+
+
+def place_legacy(layout, top_cell, cells):
+    x, y = 0, cell_Height + cell_Gap_Height
+    max_cell_Width = 0
+    positions = []
+    for cell, cell_src, bbox in cells:
+        iter1 = pya.RecursiveShapeIterator(layout, top_cell, layout.find_layer(99, 0))
+        r1 = pya.Region()
+        while not iter1.at_end():
+            if not iter1.shape().is_text():
+                r1.insert(iter1.shape().polygon.transformed(iter1.trans()))
+            iter1.next()
+        r1.merge()
+        max_cell_Width = max(max_cell_Width, bbox.right)
+        x, y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height2, bbox.top, max_cell_Width)
+        while pya.Region(pya.Box(x, y, x + bbox.width(), y + bbox.height())).interacting(r1):
+            x, y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height2, bbox.top, max_cell_Width)
+        top_cell.insert(pya.CellInstArray(cell.cell_index(), pya.Trans(x, y)))
+        positions.append((x, y))
+        y += bbox.height()
+    return positions
+
+
+def place_indexed(layout, top_cell, cells):
+    fp_index = FloorplanIndex()
+    fp_index.insert_cell(top_cell, layout.find_layer(99, 0))
+    x, y = 0, cell_Height + cell_Gap_Height
+    max_cell_Width = 0
+    positions = []
+    for cell, cell_src, bbox in cells:
+        max_cell_Width = max(max_cell_Width, bbox.right)
+        x, y, max_cell_Width = find_position(fp_index, x, y, bbox.width(), bbox.height(), bbox.top,
+            max_cell_Width, cell_Gap_Height, cell_Gap_Width, chip_Height2)
+        t = pya.Trans(x, y)
+        top_cell.insert(pya.CellInstArray(cell.cell_index(), t))
+        fp_index.insert_cell(cell_src, cell_src.layout().find_layer(99, 0), t)
+        positions.append((x, y))
+        y += bbox.height()
+    return positions
+
+
+def run(method, n, seed):
+    layout, top_cell, cells, layout_src = synthetic_chip(n, seed)
+    start_time = time.time()
+    positions = method(layout, top_cell, cells)
+    return time.time() - start_time, positions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the merge placement step')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500, 1000, 2000])
+    parser.add_argument('--legacy-max', type=int, default=500, help='largest size to run with the legacy approach')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('%8s %14s %14s %14s' % ('N', 'indexed ms/sub', 'legacy ms/sub', 'speedup'))
+    for n in args.sizes:
+        t_indexed, p_indexed = run(place_indexed, n, args.seed)
+        if n <= args.legacy_max:
+            t_legacy, p_legacy = run(place_legacy, n, args.seed)
+            if p_legacy != p_indexed:
+                sys.exit('ERROR: indexed and legacy placement differ for N=%s' % n)
+            print('%8s %14.3f %14.3f %13.1fx' % (n, 1e3 * t_indexed / n, 1e3 * t_legacy / n, t_legacy / t_indexed))
+        else:
+            print('%8s %14.3f %14s %14s' % (n, 1e3 * t_indexed / n, '-', '-'))
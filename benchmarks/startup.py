@@ -0,0 +1,120 @@
+'''
+Start-up time of the command line scripts, against a budget for each
+
+Runs each script in a new Python process, with -X importtime, and reports
+the wall time, the time spent importing modules, and the slowest imports
+(cumulative, top level).  The budget is for the import time: it is what
+each CI invocation pays before any work is done.  SiEPIC-Tools and the
+PDK take most of it, and the SiEPIC import includes a query to PyPI for
+its latest version, so the times depend on the network.
+
+ - verification --help: argument parsing only
+ - verification cached: a file verified before (in .cache/verification)
+ - verification: a file, with --no-cache
+ - submission checks: a file
+ - merge --plan: the placement of a file, with --no-cache
+
+The file is copied into a scratch folder, where the lyrdb reports and the
+files written by the scripts go; merge --plan writes EBeam.plan.* in merge/.
+
+Usage:
+  python benchmarks/startup.py
+  python benchmarks/startup.py --repeat 3 --check
+  python benchmarks/startup.py --file submissions/EBeam_natasha8243.gds
+
+'''
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+path = os.path.dirname(os.path.realpath(__file__))
+root = os.path.abspath(os.path.join(path, '..'))
+
+# import time budget of each case, in seconds
+budgets = {
+    'verification --help': 0.35,
+    'verification cached': 0.35,
+    'verification': 1.5,
+    'submission checks': 1.2,
+    'merge --plan': 0.4,
+}
+
+
+def cases(f, folder):
+    '''(name, command line, working folder) of each case, for the file f in folder'''
+    submissions = os.path.join(folder, 'submissions')
+    return [
+        ('verification --help', [os.path.join(root, 'run_verification.py'), '--help'], root),
+        ('verification cached', [os.path.join(root, 'run_verification.py'), '--batch', f], root),
+        ('verification', [os.path.join(root, 'run_verification.py'), '--no-cache', f], root),
+        ('submission checks', [os.path.join(root, 'run_submission_checks.py'), f], folder),
+        ('merge --plan', [os.path.join(root, 'merge', 'EBeam_merge.py'), '--plan', '--no-cache', '--submissions', submissions], root),
+    ]
+
+
+def import_times(stderr):
+    '''
+    Cumulative import time of the top-level imports, in seconds, by module,
+    from the output of python -X importtime
+    '''
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # nested imports are indented
+        if not name[1:].startswith(' '):
+            times[name.strip()] = times.get(name.strip(), 0) + int(cumulative) / 1e6
+    return times
+
+
+def run(command, cwd):
+    '''Wall time and import times of the command'''
+    start_time = time.time()
+    p = subprocess.run([sys.executable, '-X', 'importtime'] + command, cwd=cwd,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors='replace')
+    return time.time() - start_time, import_times(p.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the start-up time of the scripts')
+    parser.add_argument('--file', default=os.path.join(root, 'submissions', 'EBeam_LukasChrostowski_MZI.oas'), help='layout file')
+    parser.add_argument('--repeat', type=int, default=1, help='runs of each case; the fastest is reported')
+    parser.add_argument('--top', type=int, default=3, help='number of slowest imports shown')
+    parser.add_argument('--check', action='store_true', help='exit with an error if a case is over its budget')
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    os.makedirs(os.path.join(folder, 'submissions'))
+    f = os.path.join(folder, os.path.basename(args.file))
+    shutil.copyfile(args.file, f)
+    shutil.copyfile(args.file, os.path.join(folder, 'submissions', os.path.basename(args.file)))
+
+    # for the cached case
+    subprocess.run([sys.executable, os.path.join(root, 'run_verification.py'), f], cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    print('%-20s %8s %8s %8s %6s  %s' % ('case', 'wall s', 'import s', 'budget', '', 'slowest imports (s)'))
+    over = []
+    for name, command, cwd in cases(f, folder):
+        wall, times = None, None
+        for i in range(args.repeat):
+            w, t = run(command, cwd)
+            if wall is None or w < wall:
+                wall, times = w, t
+        total = sum(times.values())
+        status = 'ok' if total <= budgets[name] else 'OVER'
+        if status != 'ok':
+            over.append(name)
+        slowest = sorted(times.items(), key=lambda item: -item[1])[:args.top]
+        print('%-20s %8.2f %8.2f %8.2f %6s  %s' % (name, wall, total, budgets[name], status,
+              ', '.join('%s %.2f' % item for item in slowest)))
+    shutil.rmtree(folder)
+
+    if args.check and over:
+        print('Over the start-up budget: %s' % ', '.join(over))
+        sys.exit(1)
@@ -0,0 +1,211 @@
+'''
+Synthetic submission corpus, for scale-testing the merge, checks and verification
+
+Writes N synthetic EBeam designs into a scratch submissions folder, e.g.:
+  python benchmarks/synthetic_submissions.py 200 --output /tmp/synthetic/submissions
+  python merge/EBeam_merge.py --submissions /tmp/synthetic/submissions
+  python run_submission_checks.py /tmp/synthetic/submissions/EBeam_synthetic0000.oas
+
+Each design is a 605 x 410 um Floorplan, containing:
+ - circuits: Mach-Zehnder interferometers built from the PDK cells
+   GC_TE_1550_8degOxide_BB and ebeam_y_1550, with Strip TE waveguides
+   (two black-box grating couplers each, at most 8 fit in the design)
+ - extra grating couplers: the remaining black-box GC instances, in a row
+   along the top; they overlap when there are too many to fit
+ - labels: opt_in measurement labels, on the circuits first, then on
+   the extra grating couplers, then in the polygon area
+ - polygons: random boxes on the Si layer, split across a chain of
+   nested cells (hierarchy depth)
+and, for a fraction of the files:
+ - wrong DBU: written with a 0.5 nm database unit instead of 1 nm
+ - oversize: the Floorplan and the polygon area are 1.5 times too large
+
+The corpus is reproducible: file i only depends on the seed, i, and the
+parameters.  A summary of the corpus is written to corpus.json.
+
+'''
+
+import argparse
+import json
+import os
+import random
+import time
+
+import pya
+from pya import Box, CellInstArray, LayerInfo, Text, Trans
+
+cell_Width = 605000
+cell_Height = 410000
+layer_Si = LayerInfo(1, 0)
+layer_Text = LayerInfo(10, 0)
+layer_FloorPlan = LayerInfo(99, 0)
+cell_gc = 'GC_TE_1550_8degOxide_BB'
+cell_y = 'ebeam_y_1550'
+waveguide_type = 'Strip TE 1550 nm, w=500 nm'
+wrong_dbu = 0.0005
+
+# circuits, at the position of their lower grating coupler
+circuit_x = [45000, 150000, 255000, 360000]
+circuit_y = [15000, 180000]
+# extra grating couplers, in a row along the top
+gc_row_x = (40000, 440000)
+gc_row_y = 370000
+# polygon area, to the right of the circuits
+polygon_area = Box(450000, 0, cell_Width, 335000)
+
+_template = None
+
+
+def mzi_template():
+    '''
+    Layout with an MZI cell, with its lower grating coupler at the origin;
+    built once, and copied into each design as static cells
+    '''
+    global _template
+    if _template is None:
+        import siepic_ebeam_pdk
+        from SiEPIC.utils import create_cell2
+        from SiEPIC.utils.layout import new_layout, coupler_array
+        from SiEPIC.scripts import connect_cell, connect_pins_with_waveguide
+
+        cell, ly = new_layout('EBeam', 'MZI', GUI=False, overwrite=True)
+        cell_ebeam_y = create_cell2(ly, cell_y, 'EBeam')
+        instGC = coupler_array(cell, cell_name=cell_gc, cell_library='EBeam',
+            x_offset=0, y_offset=0, label_location=0, count=2)
+        instY1 = connect_cell(instGC[1], 'opt1', cell_ebeam_y, 'opt1')
+        instY1.transform(Trans(20000, 0))
+        instY2 = connect_cell(instGC[0], 'opt1', cell_ebeam_y, 'opt1')
+        instY2.transform(Trans(20000, 0))
+        connect_pins_with_waveguide(instGC[1], 'opt1', instY1, 'opt1', waveguide_type=waveguide_type)
+        connect_pins_with_waveguide(instGC[0], 'opt1', instY2, 'opt1', waveguide_type=waveguide_type)
+        connect_pins_with_waveguide(instY1, 'opt2', instY2, 'opt3', waveguide_type=waveguide_type)
+        connect_pins_with_waveguide(instY1, 'opt3', instY2, 'opt2', waveguide_type=waveguide_type, turtle_B=[25, -90])
+        _template = ly
+    return _template
+
+
+def synthetic_submission(file_out, top_cell_name, rng, polygons=1000, depth=3, labels=4, gc=8,
+                         wrong_dbu_file=False, oversize=False):
+    '''
+    Write one synthetic design to file_out, using the random generator rng.
+    Returns a summary dict of the design.
+    '''
+    template = mzi_template()
+    layout = pya.Layout()
+    layout.dbu = 0.001
+    top_cell = layout.create_cell(top_cell_name)
+    li_Si = layout.layer(layer_Si)
+    li_Text = layout.layer(layer_Text)
+    scale = 1.5 if oversize else 1
+
+    # Floorplan
+    cell_fp = layout.create_cell('FloorPlan')
+    cell_fp.shapes(layout.layer(layer_FloorPlan)).insert(Box(0, 0, int(cell_Width*scale), int(cell_Height*scale)))
+    top_cell.insert(CellInstArray(cell_fp.cell_index(), Trans()))
+
+    # Circuits
+    cell_mzi = layout.create_cell('MZI')
+    cell_mzi.copy_tree(template.top_cell())
+    gc_positions = []
+    positions = [(x, y) for y in circuit_y for x in circuit_x]
+    circuits = min(gc // 2, len(positions))
+    for x, y in positions[:circuits]:
+        top_cell.insert(CellInstArray(cell_mzi.cell_index(), Trans(x, y)))
+        gc_positions.append((x, y))
+
+    # Extra grating couplers
+    extra = gc - 2 * circuits
+    if extra > 0:
+        cell_ebeam_gc = layout.cell(cell_gc)
+        pitch = min(45000, (gc_row_x[1] - gc_row_x[0]) // extra)
+        for i in range(extra):
+            x = gc_row_x[0] + i * pitch
+            top_cell.insert(CellInstArray(cell_ebeam_gc.cell_index(), Trans(x, gc_row_y)))
+            gc_positions.append((x, gc_row_y))
+
+    # Labels
+    area = Box(polygon_area.left, polygon_area.bottom, int(polygon_area.right*scale), int(polygon_area.top*scale))
+    for i in range(labels):
+        if i < len(gc_positions):
+            x, y = gc_positions[i]
+        else:
+            x, y = rng.randrange(area.left, area.right), rng.randrange(area.bottom, area.top)
+        text = Text('opt_in_TE_1550_device_%s_%s' % (top_cell_name, i), Trans(x, y))
+        top_cell.shapes(li_Text).insert(text).text_size = 5000
+
+    # Polygons, in a chain of nested cells
+    cell = top_cell
+    cells = []
+    for level in range(depth):
+        subcell = layout.create_cell('polygons_%s' % (level+1))
+        cell.insert(CellInstArray(subcell.cell_index(), Trans()))
+        cells.append(subcell)
+        cell = subcell
+    cells = cells or [top_cell]
+    for i in range(polygons):
+        w, h = rng.randrange(500, 5000, 10), rng.randrange(500, 5000, 10)
+        x, y = rng.randrange(area.left, area.right - w, 10), rng.randrange(area.bottom, area.top - h, 10)
+        cells[i * len(cells) // polygons].shapes(li_Si).insert(Box(x, y, x+w, y+h))
+
+    if wrong_dbu_file:
+        # same geometry, in a different database unit
+        scaling = layout.dbu / wrong_dbu
+        layout.dbu = wrong_dbu
+        layout.transform(pya.ICplxTrans(scaling, 0, False, 0, 0))
+
+    # no timestamps, so that the files are reproducible
+    options = pya.SaveLayoutOptions()
+    options.gds2_write_timestamps = False
+    layout.write(file_out, options)
+
+    return {'file': os.path.basename(file_out), 'top_cell': top_cell_name,
+            'polygons': polygons, 'depth': depth, 'labels': labels,
+            'gc': gc, 'circuits': circuits, 'dbu': layout.dbu, 'oversize': oversize}
+
+
+def generate_corpus(folder, n, seed=0, polygons=1000, depth=3, labels=4, gc=8,
+                    wrong_dbu_fraction=0, oversize_fraction=0, format='oas', prefix='EBeam'):
+    '''
+    Write n synthetic designs into folder, and corpus.json with their summary.
+    format: 'oas', 'gds', or 'mixed'
+    '''
+    os.makedirs(folder, exist_ok=True)
+    designs = []
+    for i in range(n):
+        # one generator per file, so that file i does not depend on n
+        rng = random.Random('%s-%s' % (seed, i))
+        is_wrong_dbu = rng.random() < wrong_dbu_fraction
+        is_oversize = rng.random() < oversize_fraction
+        extension = format if format != 'mixed' else rng.choice(['oas', 'gds'])
+        name = '%s_synthetic%04d' % (prefix, i)
+        designs.append(synthetic_submission(os.path.join(folder, name + '.' + extension), name, rng,
+            polygons=polygons, depth=depth, labels=labels, gc=gc,
+            wrong_dbu_file=is_wrong_dbu, oversize=is_oversize))
+
+    with open(os.path.join(folder, 'corpus.json'), 'w') as f:
+        json.dump({'seed': seed, 'n': n, 'designs': designs}, f, indent=1)
+    return designs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write a synthetic corpus of EBeam submissions')
+    parser.add_argument('n', type=int, help='number of designs')
+    parser.add_argument('--output', default=os.path.join('synthetic', 'submissions'), help='folder for the designs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--polygons', type=int, default=1000, help='number of random boxes on the Si layer, per design')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the cell hierarchy containing the boxes')
+    parser.add_argument('--labels', type=int, default=4, help='number of opt_in labels, per design')
+    parser.add_argument('--gc', type=int, default=8, help='number of black-box grating coupler instances, per design')
+    parser.add_argument('--wrong-dbu', type=float, default=0, help='fraction of the designs written with a wrong DBU')
+    parser.add_argument('--oversize', type=float, default=0, help='fraction of the designs larger than the allocated area')
+    parser.add_argument('--format', choices=['oas', 'gds', 'mixed'], default='oas')
+    parser.add_argument('--prefix', default='EBeam', help='file name prefix, which sets the course in the merge')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    designs = generate_corpus(args.output, args.n, seed=args.seed,
+        polygons=args.polygons, depth=args.depth, labels=args.labels, gc=args.gc,
+        wrong_dbu_fraction=args.wrong_dbu, oversize_fraction=args.oversize,
+        format=args.format, prefix=args.prefix)
+    print('Wrote %s designs to %s in %.1f seconds (%s wrong DBU, %s oversize)' % (len(designs), args.output,
+        time.time() - start_time, sum(d['dbu'] != 0.001 for d in designs), sum(d['oversize'] for d in designs)))
@@ -9,7 +9,8 @@ Input:
 - containing files {EBeam*, openEBL_*, ELEC463*, ELEC413*, SiEPIC_Passives*, SiEPIC_Actives*}.{GDS,gds,OAS,oas,py}
 Output
 - in folder "merge"
--   files: EBeam.oas, EBeam.txt, EBeam.coords
+-   files: EBeam.oas, EBeam.txt, EBeam.coords, EBeam.labels.csv
+-   with --plan: EBeam.plan.txt, EBeam.plan.csv, EBeam.plan.svg (placement only)
 
 '''
 
@@ -42,6 +43,22 @@ log_siepictools = False
 framework_file = 'EBL_Framework_1cm_PCM_static.oas'
 ubc_file = 'UBC_static.oas'
 
+# command line options
+import argparse
+parser = argparse.ArgumentParser(description='Automated merge of the submissions into the chip layout')
+parser.add_argument('--submissions', help='folder containing the submissions (default: ../submissions)')
+parser.add_argument('--jobs', type=int, default=1, help='number of worker processes used to load and normalize the files (0: one per CPU)')
+parser.add_argument('--no-cache', action='store_true', help='do not use the cache of normalized submissions')
+parser.add_argument('--cache-size', type=int, default=500, help='maximum size of the cache of normalized submissions, in MB')
+parser.add_argument('--cache-check', action='store_true', help='verify the cache of normalized submissions, and remove corrupt entries')
+parser.add_argument('--export', choices=['fast', 'compact', 'gds'], default='compact', help='export profile for the chip layout: fast (uncompressed OASIS), compact (compressed OASIS), or gds')
+parser.add_argument('--no-dedup', action='store_true', help='do not share the identical cells between the submissions')
+parser.add_argument('--png-width', type=int, default=1600, help='width of the EBeam.png image, in pixels')
+parser.add_argument('--packing', choices=['columns', 'skyline'], default='columns', help='placement of the submissions: columns, filled in order (default); or skyline, bottom-left packing which puts narrower cells side by side, and keeps the cells on the chip and out of the PCM cutouts')
+parser.add_argument('--plan', action='store_true', help='only plan the placement, from the bounding box and Floorplan of each file: write EBeam.plan.txt, the table EBeam.plan.csv and the overview EBeam.plan.svg, without the chip layout')
+parser.add_argument('--png-pyramid', type=int, default=0, help='number of levels of a zoomable tile pyramid of the chip, in EBeam_tiles (0: none)')
+args, _ = parser.parse_known_args()
+
 
 # record processing time
 import time
@@ -51,22 +68,13 @@ now = datetime.now()
 
 # KLayout
 import pya
-from pya import *
-
-# SiEPIC-Tools
-import SiEPIC
-from SiEPIC._globals import Python_Env, KLAYOUT_VERSION, KLAYOUT_VERSION_3
-from SiEPIC.scripts import zoom_out, export_layout
-from SiEPIC.utils import find_automated_measurement_labels
 import os
 
+# SiEPIC-Tools and the PDK are only needed for the image of the chip, and
+# imported there: the normalization and placement use KLayout only, and
+# --plan does not load them (see benchmarks/startup.py)
+from importlib.metadata import version
 
-# Output layout
-layout = pya.Layout()
-layout.dbu = dbu
-top_cell = layout.create_cell(top_cell_name)
-layerText = pya.LayerInfo(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
-layerTextN = top_cell.layout().layer(layerText)
 
 def disable_libraries():
     print('Disabling KLayout libraries')
@@ -79,15 +87,19 @@ disable_libraries()
 # path for this python file
 path = os.path.dirname(os.path.realpath(__file__))
 
+# helper modules for the merge, in the same folder
+import sys
+sys.path.insert(0, path)
+
 # Log file
 global log_file
-log_file = open(os.path.join(path,filename_out+'.txt'), 'w')
+log_file = open(os.path.join(path,filename_out+('.plan' if args.plan else '')+'.txt'), 'w')
 def log(text):
     global log_file
     log_file.write(text)
     log_file.write('\n')
 
-log('SiEPIC-Tools %s, layout merge, running KLayout 0.%s.%s ' % (SiEPIC.__version__, KLAYOUT_VERSION,KLAYOUT_VERSION_3) )
+log('SiEPIC-Tools %s, layout merge, running KLayout %s ' % (version('SiEPIC'), pya.__version__) )
 current_time = now.strftime("%Y-%m-%d, %H:%M:%S local time")
 log("Date: %s" % current_time)
 
@@ -99,256 +111,104 @@ for f in sorted(files):
     files_in.append(os.path.join(path2,f))
 
 # Load all the GDS/OAS files from the "submissions" folder:
-path2 = os.path.abspath(os.path.join(path,"../submissions"))
+path2 = os.path.abspath(args.submissions or os.path.join(path,"../submissions"))
 _, _, files = next(os.walk(path2), (None, None, []))
 for f in sorted(files):
     files_in.append(os.path.join(path2,f))
 
-# Create course cells using the folder name under the top cell
-cell_edXphot1x = layout.create_cell("edX")
-t = Trans(Trans.R0, 0,0)
-top_cell.insert(CellInstArray(cell_edXphot1x.cell_index(), t))
-cell_ELEC413 = layout.create_cell("ELEC413")
-top_cell.insert(CellInstArray(cell_ELEC413.cell_index(), t))
-cell_SiEPIC_Passives = layout.create_cell("SiEPIC_Passives")
-top_cell.insert(CellInstArray(cell_SiEPIC_Passives.cell_index(), t))
-cell_openEBL = layout.create_cell("openEBL")
-top_cell.insert(CellInstArray(cell_openEBL.cell_index(), t))
-
-# Create a date	stamp cell, and add a text label
-merge_stamp = '.merged:'+now.strftime("%Y-%m-%d-%H:%M:%S")
-cell_date = layout.create_cell(merge_stamp)
-text = Text (merge_stamp, Trans(Trans.R0, 0, 0) )
-shape = cell_date.shapes(layout.layer(10,0)).insert(text)
-top_cell.insert(CellInstArray(cell_date.cell_index(), t))   
-
-# Origins for the layouts
-x,y = 0,cell_Height+cell_Gap_Height
-
-# Keep track of the width of the cells, for each column
-max_cell_Width = 0
-
-import subprocess
-import pandas as pd
-for f in [f for f in files_in if '.oas' in f[-4:].lower() or '.gds' in f[-4:].lower()]:
+# Configuration for the per-file normalization
+merge_config = {
+    'dbu': dbu,
+    'layers_keep': layers_keep,
+    'layer_text': layer_text,
+    'layer_SEM': layer_SEM,
+    'layer_SEM_allow': layer_SEM_allow,
+    'cell_Width': cell_Width,
+    'cell_Height': cell_Height,
+    'log_siepictools': log_siepictools,
+    'framework_file': framework_file,
+    'ubc_file': ubc_file,
+}
+
+files_in = [f for f in files_in if '.oas' in f[-4:].lower() or '.gds' in f[-4:].lower()]
+
+# Cache of the normalized submissions, to only process new or changed files
+from normalized_cache import NormalizedCache
+cache = None
+if not args.no_cache:
+    cache = NormalizedCache(os.path.join(path, '.cache', 'normalized'), max_size=args.cache_size*1024*1024)
+    if args.cache_check:
+        print('Normalized submissions cache: %s valid entries, %s removed' % cache.check())
+
+# Output layout: the chip, with the course cells and a date stamp,
+# and the placement of the files
+from merge_session import MergeSession
+# PCM cutouts, kept free by the skyline packing
+pcm_cutouts = [pya.Box(br_cutout_x, 0, chip_Width, br_cutout_y), pya.Box(br_cutout2_x, 0, chip_Width, br_cutout2_y)] + \
+    [pya.Box(int(x), int(y), chip_Width, chip_Height2) for x, y in zip(tr_cutout_x, tr_cutout_y)]
+session = MergeSession(merge_config, top_cell_name, cell_Gap_Width=cell_Gap_Width, cell_Gap_Height=cell_Gap_Height,
+    chip_Height=chip_Height2, packing=args.packing, chip_Width=chip_Width, obstacles=pcm_cutouts, layers_move=layers_move, cache=cache, log=log, plan=args.plan, now=now)
+
+# Date of each file: the time it was last committed, from one walk of the
+# git history (cached by commit), or its modification time outside a repository
+from file_dates import file_dates
+dates = file_dates(files_in, os.path.join(path, '.cache', 'file_dates.json'))
+
+# Load and normalize the files, either here one at a time,
+# or in worker processes which return the normalized cells as OASIS blobs.
+# The placement and copy into the chip is done here, in order.
+from normalize import normalize_files
+jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+results = normalize_files(files_in, merge_config, jobs=jobs, cache=cache, plan=args.plan)
+
+# Time spent in each stage, per file, for EBeam.perf.json
+from perf import StageTimer, peak_rss
+perf_files = []
+perf_stages = {'setup': time.time() - start_time}
+timer = StageTimer()
+
+for f, layout2, info in results:
     basefilename = os.path.basename(f)
 
-    # GitHub Action gets the actual time committed.  This can be done locally
-    # via git restore-mtime.  Then we can load the time from the file stamp
-
-    filedate = datetime.fromtimestamp(os.path.getmtime(f)).strftime("%Y%m%d_%H%M")
-    log("\nLoading: %s, dated %s" % (os.path.basename(f), filedate))
-
-    # Tried to get it from GitHub but that didn't work:
-    # get the time the file was last updated from the Git repository 
-    # a = subprocess.run(['git', '-C', os.path.dirname(f), 'log', '-1', '--pretty=%ci',  basefilename], stdout = subprocess.PIPE) 
-    # filedate = pd.to_datetime(str(a.stdout.decode("utf-8"))).strftime("%Y%m%d_%H%M")
-    #filedate = os.path.getctime(os.path.dirname(f)) # .strftime("%Y%m%d_%H%M")
-    
-  
-    # Load layout  
-    layout2 = pya.Layout()
-    layout2.read(f)
-
-    if 'elec413' in basefilename.lower():
-        course = 'ELEC413'
-    elif 'openebl' in basefilename.lower():
-        course = 'openEBL'
-    elif 'siepic_passives' in basefilename.lower():
-        course = 'SiEPIC_Passives'
-    elif 'ebeam' in basefilename.lower():
-        course = 'edXphot1x'
-    else:
-        course = 'openEBL'
-
-    cell_course = eval('cell_' + course)
-    log("  - course name: %s" % (course) )
-
-    # Check the DBU Database Unit, in case someone changed it, e.g., 5 nm, or 0.1 nm.
-    if round(layout2.dbu,10) != dbu:
-        log('  - WARNING: The database unit (%s dbu) in the layout does not match the required dbu of %s.' % (layout2.dbu, dbu))
-        print('  - WARNING: The database unit (%s dbu) in the layout does not match the required dbu of %s.' % (layout2.dbu, dbu))
-        # Step 1: change the DBU to match, but that magnifies the layout
-        wrong_dbu = layout2.dbu
-        layout2.dbu = dbu
-        # Step 2: scale the layout
-        try:
-            # determine the scaling required
-            scaling = round(wrong_dbu / dbu, 10)
-            layout2.transform (pya.ICplxTrans(scaling, 0, False, 0, 0))
-            log('  - WARNING: Database resolution has been corrected and the layout scaled by %s' % scaling) 
-        except:
-            print('ERROR IN EBeam_merge.py: Incorrect DBU and scaling unsuccessful')
-    
-    # check that there is one top cell in the layout
-    num_top_cells = len(layout2.top_cells())
-    if num_top_cells > 1:
-        log('  - layout should only contain one top cell; contains (%s): %s' % (num_top_cells, [c.name for c in layout2.top_cells()]) )
-    if num_top_cells == 0:
-        log('  - layout does not contain a top cell')
-
-    # Find the top cell
-    for cell in layout2.top_cells():
-        if os.path.basename(f) == framework_file:
-            # Create sub-cell using the filename under top cell
-            subcell2 = layout.create_cell(os.path.basename(f)+"_"+filedate)
-            t = Trans(Trans.R0, 0,0)
-            top_cell.insert(CellInstArray(subcell2.cell_index(), t))
-            # copy
-            subcell2.copy_tree(layout2.cell(cell.name)) 
-            break
-
-        if os.path.basename(f) == ubc_file:
-            # Create sub-cell using the filename under top cell
-            subcell2 = layout.create_cell(os.path.basename(f)+"_"+filedate)
-            t = Trans(Trans.R0, 8780000,8780000)      
-            top_cell.insert(CellInstArray(subcell2.cell_index(), t))
-            # copy
-            subcell2.copy_tree(layout2.cell(cell.name)) 
-            break
-
-
-        if num_top_cells == 1 or cell.name.lower() == 'top' or cell.name.lower() == 'EBeam_':
-            log("  - top cell: %s" % cell.name)
-
-            # check layout height
-            if cell.bbox().top < cell.bbox().bottom:
-                log(' - WARNING: empty layout. Skipping.')
-                break
-                
-            # Create sub-cell using the filename under course cell
-            subcell2 = layout.create_cell(os.path.basename(f)+"_"+filedate)
-            
-            # Clear extra layers
-            layers_keep2 = [layer_SEM] if course in layer_SEM_allow else []
-            for li in layout2.layer_infos():
-                if li.to_s() in layers_keep + layers_keep2:
-                    log('  - loading layer: %s' % li.to_s())
-                else:
-                    log('  - deleting layer: %s' % li.to_s())
-                    layer_index = layout2.find_layer(li)
-                    layout2.delete_layer(layer_index)
-                    
-            # Delete non-text geometries in the Text layer
-            layer_index = layout2.find_layer(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
-            if type(layer_index) != type(None):
-                s = cell.begin_shapes_rec(layer_index)
-                shapes_to_delete = []
-                while not s.at_end():
-                    if s.shape().is_text():
-                        text = s.shape().text.string
-                        if text.startswith('SiEPIC-Tools'):
-                            if log_siepictools:
-                                log('  - %s' % s.shape() )
-                            s.shape().delete()
-                            subcell2.shapes(layerTextN).insert(pya.Text(text, 0, 0))
-                        elif text.startswith('opt_in'):
-                            log('  - measurement label: %s' % text )
-                    else:
-                        shapes_to_delete.append( s.shape() )
-                    s.next()
-                for s in shapes_to_delete:
-                    s.delete()
-
-            # bounding box of the cell
-            bbox = cell.bbox()
-            log('  - bounding box: %s' % bbox.to_s() )
-                            
-            # Create sub-cell under subcell cell, using user's cell name
-            subcell = layout.create_cell(cell.name)
-            t = Trans(Trans.R0, -bbox.left,-bbox.bottom)
-            subcell2.insert(CellInstArray(subcell.cell_index(), t))
-        
-            # clip / crop cells
-            cell2 = layout2.clip(cell.cell_index(), pya.Box(bbox.left,bbox.bottom,bbox.left+cell_Width,bbox.bottom+cell_Height))
-            bbox2 = layout2.cell(cell2).bbox()
-            if bbox != bbox2:
-                log('  - WARNING: Cell was clipped to maximum size of %s X %s' % (cell_Width, cell_Height) )
-                log('  - clipped bounding box: %s' % bbox2.to_s() )
-
-            # Copy the cropped version
-            subcell.copy_tree(layout2.cell(cell2))  
-
-            # Check if this cell would overlap with other Floorplans, then move if necessary
-
-            # Get Floorplan regions for the entire chip so far
-            Layer_FP = layout.find_layer(99,0)  # or use "layer"
-            iter1 = pya.RecursiveShapeIterator(layout, top_cell, Layer_FP )
-            r1 = pya.Region()
-            while not iter1.at_end():
-                # print("   - %s" % iter1.trans())
-                if not iter1.shape().is_text(): 
-                    r1.insert(iter1.shape().polygon.transformed(iter1.trans())) 
-                iter1.next()        
-            r1.merge()
-
-            # Track the maximum width of the cells, for each column
-            x_offset = 0
-            max_cell_Width = max(max_cell_Width, subcell2.bbox().right + x_offset)
-            
-            def next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height, cell_Height, cell_Width):
-                # Measure the height of the cell that was added, and move up
-                y += cell_Gap_Height
-                if y + subcell2.bbox().top > chip_Height2:
-                    y = 0
-                    x += cell_Width + cell_Gap_Width
-                    cell_Width = 0
-                return x, y, cell_Width
-
-            x,y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height2, cell_Height, max_cell_Width)
-            
-            interacting = True
-            while interacting:
-                r2 = pya.Region(pya.Box(x+x_offset,y, x+x_offset+bbox2.width(),y+bbox2.height()))
-                interacting = r2.interacting(r1)
-                if interacting:
-                    # print("   - Overlapping Floorplan: %s" % r2.interacting(r1))
-                    x,y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height2, cell_Height, max_cell_Width)
-
-
-            # Insert cell instance in the chip
-            t = Trans(Trans.R0, x+x_offset,y)
-            cell_course.insert(CellInstArray(subcell2.cell_index(), t))            
-            log('  - Placed at position: %s, %s' % (x,y) )
-                
-            # Measure the height of the cell that was added, and move up
-            y += subcell.bbox().height()
-            
-            '''
-            if y + cell_Height > chip_Height1 and x == 0:
-                y = cell_Height + cell_Gap_Height
-                x += cell_Width + cell_Gap_Width
-            if y + cell_Height > chip_Height2:
-                y = cell_Height + cell_Gap_Height
-                x += cell_Width + cell_Gap_Width
-            # check top right cutout for PCM
-            for i in range(len(tr_cutout_x)):
-                if x + cell_Width > tr_cutout_x[i] and y + cell_Height > tr_cutout_y[i]:
-                    # go to the next column
-                    y = cell_Height + cell_Gap_Height    
-                    x += cell_Width + cell_Gap_Width
-            # Check bottom right cutout for PCM
-            if x + cell_Width > br_cutout_x and y < br_cutout_y:
-                y = br_cutout_y
-            # Check bottom right cutout #2 for PCM
-            if x + cell_Width > br_cutout2_x and y < br_cutout2_y:
-                y = br_cutout2_y
-            '''
-
-
-# move layers
-for i in range(0,len(layers_move)):
-    layer1=layout.find_layer(*layers_move[i][0])
-    layer2=layout.find_layer(*layers_move[i][1])
-    layout.move_layer(layer1, layer2)
-
-# Export as-is layout, for UW fabrication
-log('')
-
-#export_layout (top_cell, path, filename='EBeam', relative_path='', format='gds')
-file_out = export_layout (top_cell, path, filename='EBeam', relative_path='', format='oas')
-# log("Layout exported successfully %s: %s" % (save_options.format, file_out) )
+    # time to get the normalized file: normalized in this process, from a worker, or from the cache
+    timer.lap('load')
+
+    # place the file on the chip, and copy the normalized cell
+    session.place(f, layout2, info, dates[f], timer=timer)
 
+    if info['cached']:
+        # only load and place were done in this run; the normalization
+        # stages are those of the run that filled the cache
+        perf_files.append({'file': basefilename, 'cached': True, 'rss_kB': None,
+            'stages': dict(timer.stages), 'cached_perf': info['perf']})
+    else:
+        perf_files.append({'file': basefilename, 'cached': False, 'rss_kB': info['perf']['rss_kB'],
+            'stages': dict([(k, v) for k, v in info['perf'].items() if k != 'rss_kB'] + list(timer.stages.items()))})
+    timer = StageTimer()
+
+if args.plan:
+    # Placement only: the table and the overview, and no chip layout
+    from plan import write_table, write_svg
+    plan_rows = session.plan_rows()
+    write_table(os.path.join(path, filename_out+'.plan.csv'), plan_rows)
+    write_svg(os.path.join(path, filename_out+'.plan.svg'), session.library_floorplans(), plan_rows, dbu=dbu)
+    log("\nPlan: %s cells placed, %s clipped" % (len(plan_rows), sum(row['clipped'] for row in plan_rows)))
+    log("\nExecution time: %s seconds" % int((time.time() - start_time)))
+    log_file.close()
+    print("KLayout EBeam_merge.py --plan, completed in: %.1f seconds" % (time.time() - start_time))
+    sys.exit(0)
+
+# Measurement labels on the chip, with their coordinates, for the automated measurements
+labels = session.labels(timer=timer)
+labels.write_coords(os.path.join(path, filename_out+'.coords'))
+labels.write_table(os.path.join(path, filename_out+'.labels.csv'))
+log("\nMeasurement labels: %s, written to %s.coords" % (len(labels.labels), filename_out))
+for label in labels.duplicates():
+    log('  - WARNING: duplicate measurement label: %s' % label)
+
+# Write the chip: the framework and UBC cells are filled, and the identical
+# cells shared between the submissions, e.g., the PDK cells
+file_out, export_stats, dedup_stats = session.export(path, filename_out, profile=args.export, dedup=not args.no_dedup, timer=timer)
 
 log("\nExecution time: %s seconds" % int((time.time() - start_time)))
 
@@ -356,6 +216,7 @@ log_file.close()
 
 # Display the layout in KLayout, using KLayout Package "klive", which needs to be installed in the KLayout Application
 try:
+    from SiEPIC._globals import Python_Env
     if Python_Env == 'Script':
         from SiEPIC.utils import klive
         klive.show(file_out, technology=tech_name)
@@ -363,10 +224,24 @@ except:
     pass
  
 
-# Create an image of the layout
+# Create an image of the layout, rendered in tiles from the exported file;
+# the tiles are cached with the normalized submissions
 import siepic_ebeam_pdk
-layout.technology_name = 'EBeam'
-top_cell.image(os.path.join(path,'EBeam.png'))
+from render import render_png
+timer.skip()
+render_png(file_out, os.path.join(path,'EBeam.png'), session.top_cell.dbbox(), tech_name=tech_name, dbu=dbu,
+    width=args.png_width, jobs=jobs, items=session.render_items() if cache else None,
+    cache_folder=os.path.join(path, '.cache', 'tiles'),
+    pyramid_folder=os.path.join(path, filename_out+'_tiles') if args.png_pyramid else None,
+    pyramid_levels=args.png_pyramid)
+timer.lap('png')
+
+# Performance report: time spent in each stage, per file and for the chip, and peak memory
+import json
+perf_stages.update(timer.stages)
+perf_stages['total'] = time.time() - start_time
+with open(os.path.join(path, filename_out+'.perf.json'), 'w') as perf_file:
+    json.dump({'date': current_time, 'jobs': jobs, 'rss_kB': peak_rss(), 'stages': perf_stages, 'export': export_stats, 'dedup': dedup_stats, 'files': perf_files}, perf_file, indent=1)
 
 print("KLayout EBeam_merge.py, completed in: %s seconds" % int((time.time() - start_time)))
 
@@ -0,0 +1,153 @@
+'''
+Cell deduplication for the automated merge (EBeam_merge.py)
+
+Each submission brings its own copy of the PDK cells (grating couplers,
+Y-branches, waveguides), which copy_tree adds to the chip with $N
+suffixes.  Cells with the same name (apart from the $N suffixes) and the
+same geometry are replaced by a single shared cell.
+
+Cells are compared bottom-up, so identical hierarchies are found: first
+by a hash of their shapes and instances, then exactly.
+
+'''
+
+import hashlib
+import re
+from collections import Counter, defaultdict
+
+import pya
+
+
+def cell_basename(name):
+    '''Cell name without the $N suffixes added when copying cells'''
+    return re.sub(r'(\$\d+)+$', '', name)
+
+
+def shape_geometry(shape):
+    '''(type, geometry object) of a shape'''
+    if shape.is_box():
+        return ('box', shape.box)
+    if shape.is_path():
+        return ('path', shape.path)
+    if shape.is_text():
+        return ('text', shape.text)
+    if shape.is_simple_polygon():
+        return ('simple_polygon', shape.simple_polygon)
+    if shape.is_polygon():
+        return ('polygon', shape.polygon)
+    if shape.is_edge():
+        return ('edge', shape.edge)
+    if shape.is_edge_pair():
+        return ('edge_pair', shape.edge_pair)
+    if shape.is_point():
+        return ('point', shape.point)
+    return ('other', shape.to_s())
+
+
+def cell_contents(layout, cell, canonical):
+    '''
+    Shapes of cell on each layer, and its instances, in a sorted order;
+    the child cells are identified by their canonical cell index
+    '''
+    shapes = []
+    for li in layout.layer_indexes():
+        if cell.shapes(li).is_empty():
+            continue
+        items = []
+        for shape in cell.shapes(li).each():
+            kind, geometry = shape_geometry(shape)
+            items.append((kind, geometry.hash() if kind != 'other' else hash(geometry), geometry,
+                          repr(layout.properties(shape.prop_id)) if shape.prop_id else ''))
+        items.sort(key=lambda item: (item[0], item[1], item[3]))
+        shapes.append((layout.get_info(li).to_s(), items))
+    insts = sorted((canonical.get(inst.cell_index, inst.cell_index), str(inst.dcplx_trans),
+                    str(inst.a), str(inst.b), inst.na, inst.nb,
+                    repr(layout.properties(inst.prop_id)) if inst.prop_id else '')
+                   for inst in cell.each_inst())
+    return shapes, insts
+
+
+def contents_hash(contents):
+    shapes, insts = contents
+    h = hashlib.sha256()
+    for layer, items in shapes:
+        h.update(layer.encode())
+        h.update(repr([(kind, geometry_hash, props) for kind, geometry_hash, geometry, props in items]).encode())
+    h.update(repr(insts).encode())
+    return h.hexdigest()
+
+
+def contents_equal(a, b):
+    '''
+    Exact comparison of the results of cell_contents; shapes with the same
+    hash in a different order (a hash collision) compare as different
+    '''
+    return a == b
+
+
+def deduplicate_cells(layout):
+    '''
+    Replace the cells that are identical to another cell with the same
+    base name by that cell, keeping the one with the shortest name.
+
+    Returns a dict with the number of cells, shapes and instances removed,
+    and the OASIS size of the removed cells (bytes)
+    '''
+    # only compare the cells with the same name, extent, and number of
+    # shapes and instances
+    def summary(cell):
+        return (cell_basename(cell.name), cell.bbox().to_s(), cell.child_instances(),
+                tuple(cell.shapes(li).size() for li in layout.layer_indexes()))
+    summaries = Counter(summary(cell) for cell in layout.each_cell())
+
+    # find the identical cells, children first; canonical maps each
+    # duplicate to the first identical cell found
+    canonical = {}
+    found = defaultdict(list)
+    for ci in layout.each_cell_bottom_up():
+        cell = layout.cell(ci)
+        if summaries[summary(cell)] < 2:
+            continue
+        basename = cell_basename(cell.name)
+        contents = cell_contents(layout, cell, canonical)
+        candidates = found[(basename, contents_hash(contents))]
+        for cj, contents_j in candidates:
+            if contents_equal(contents, contents_j):
+                canonical[ci] = cj
+                break
+        else:
+            candidates.append((ci, contents))
+
+    # keep the cell with the shortest name, e.g., without $N
+    groups = defaultdict(list)
+    for ci, cj in canonical.items():
+        groups[cj].append(ci)
+    replace = {}
+    for cj, cells in groups.items():
+        cells.append(cj)
+        keep = min(cells, key=lambda ci: (len(layout.cell(ci).name), layout.cell(ci).name))
+        for ci in cells:
+            if ci != keep:
+                replace[ci] = keep
+
+    stats = {'cells': len(replace), 'shapes': 0, 'instances': 0, 'bytes': 0}
+    if not replace:
+        return stats
+
+    # size of the removed cells, on their own
+    options = pya.SaveLayoutOptions()
+    options.format = 'OASIS'
+    options.keep_instances = True
+    options.clear_cells()
+    for ci in replace:
+        options.add_this_cell(ci)
+        stats['shapes'] += sum(layout.cell(ci).shapes(li).size() for li in layout.layer_indexes())
+        stats['instances'] += layout.cell(ci).child_instances()
+    stats['bytes'] = len(layout.write_bytes(options))
+
+    # point the instances to the cells that are kept
+    for ci, keep in replace.items():
+        for parent_inst in list(layout.cell(ci).each_parent_inst()):
+            parent_inst.child_inst().cell_index = keep
+    layout.delete_cells(list(replace))
+    return stats
@@ -0,0 +1,48 @@
+'''
+Export profiles for the merged chip (EBeam_merge.py --export PROFILE)
+
+ - fast: OASIS without compression; quickest to write and read, largest file
+ - compact: OASIS with CBLOCKs (compressed cell blocks), repetition
+   detection (compression level 10) and strict mode; smallest file.
+   This is the format written by SiEPIC's export_layout, and the default
+ - gds: GDSII, for tools that do not read OASIS
+
+All profiles write a static layout, without PCell context information.
+
+'''
+
+import os
+import time
+
+import pya
+
+export_profiles = {
+    'fast': {'format': 'OASIS', 'oasis_compression_level': 0, 'oasis_write_cblocks': False, 'oasis_strict_mode': False},
+    'compact': {'format': 'OASIS', 'oasis_compression_level': 10, 'oasis_write_cblocks': True, 'oasis_strict_mode': True},
+    # records up to 32 kB, as some readers use signed record lengths
+    'gds': {'format': 'GDS2', 'gds2_max_vertex_count': 4000},
+}
+
+
+def save_options(profile):
+    '''SaveLayoutOptions and file extension for the export profile'''
+    options = pya.SaveLayoutOptions()
+    options.write_context_info = False
+    for name, value in export_profiles[profile].items():
+        setattr(options, name, value)
+    if options.format == 'OASIS':
+        options.oasis_permissive = True
+        return options, '.oas'
+    return options, '.gds'
+
+
+def export_chip(top_cell, path, filename, profile='compact'):
+    '''
+    Write top_cell to path/filename, with the export profile.
+    Returns the file name, and a dict with the profile, write time (s) and size (bytes)
+    '''
+    options, extension = save_options(profile)
+    file_out = os.path.join(path, filename + extension)
+    start_time = time.time()
+    top_cell.write(file_out, options)
+    return file_out, {'profile': profile, 'seconds': time.time() - start_time, 'bytes': os.path.getsize(file_out)}
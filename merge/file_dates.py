@@ -0,0 +1,117 @@
+'''
+File dates for the automated merge (EBeam_merge.py)
+
+The date of each submission is the time of the last commit that changed
+it, from a single walk of the git history (git log --name-only), rather
+than the file modification time, which needs git-restore-mtime after a
+checkout, or one git log per file.
+
+The dates are cached in a JSON file, by the HEAD commit; when HEAD moves
+forward, only the new commits are read.  Files outside a git repository,
+or not committed, use their modification time.
+
+'''
+
+import json
+import os
+import subprocess
+
+
+def git(folder, *args):
+    '''Output of a git command run in folder, or None if it fails'''
+    try:
+        result = subprocess.run(['git', '-C', folder] + list(args), stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.decode('utf-8', 'surrogateescape')
+
+
+def commit_dates(root, paths, since=None):
+    '''
+    {path: commit time} of the last commit changing each file in paths
+    (folders, relative to the repository root), from the commits after
+    since, or all the commits; None if git fails
+    '''
+    output = git(root, '-c', 'core.quotepath=off', 'log', '--format=%x00%ct', '--name-only',
+                 since + '..HEAD' if since else 'HEAD', '--', *paths)
+    if output is None:
+        return None
+    # newest commit first: the first date found for a file is its last commit
+    dates = {}
+    date = None
+    for line in output.splitlines():
+        if line.startswith('\x00'):
+            date = int(line[1:])
+        elif line and line not in dates:
+            dates[line] = date
+    return dates
+
+
+def repository_dates(root, paths, cache):
+    '''
+    commit_dates for the repository root at HEAD, using and updating the
+    cache entry for root, a dict with head, paths and dates
+    '''
+    head = (git(root, 'rev-parse', 'HEAD') or '').strip()
+    if not head:
+        return {}
+    entry = cache.get(root)
+    if entry and entry['paths'] == paths:
+        if entry['head'] == head:
+            return entry['dates']
+        # HEAD moved forward: only read the new commits
+        if git(root, 'merge-base', '--is-ancestor', entry['head'], head) is not None:
+            dates = commit_dates(root, paths, since=entry['head'])
+            if dates is not None:
+                dates = dict(entry['dates'], **dates)
+                cache[root] = {'head': head, 'paths': paths, 'dates': dates}
+                return dates
+    dates = commit_dates(root, paths)
+    if dates is None:
+        return {}
+    cache[root] = {'head': head, 'paths': paths, 'dates': dates}
+    return dates
+
+
+def file_dates(files, cache_file=None):
+    '''
+    {file: timestamp} for each file in files: the time of its last commit,
+    or its modification time.
+    cache_file: JSON file with the dates, by repository and HEAD commit
+    '''
+    cache = {}
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file) as fh:
+                cache = json.load(fh)
+        except (OSError, ValueError):
+            cache = {}
+
+    # repository of each folder
+    roots = {}
+    for f in files:
+        folder = os.path.dirname(os.path.realpath(f))
+        if folder not in roots:
+            roots[folder] = (git(folder, 'rev-parse', '--show-toplevel') or '').strip()
+
+    dates = {}
+    for root in sorted(set(r for r in roots.values() if r)):
+        paths = sorted(os.path.relpath(folder, root).replace(os.sep, '/') for folder, r in roots.items() if r == root)
+        commits = repository_dates(root, paths, cache)
+        for f in files:
+            if roots[os.path.dirname(os.path.realpath(f))] == root:
+                path = os.path.relpath(os.path.realpath(f), root).replace(os.sep, '/')
+                if path in commits:
+                    dates[f] = commits[path]
+
+    if cache_file and cache:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + '.tmp', 'w') as fh:
+            json.dump(cache, fh)
+        os.replace(cache_file + '.tmp', cache_file)
+
+    for f in files:
+        if f not in dates:
+            dates[f] = os.path.getmtime(f)
+    return dates
@@ -0,0 +1,150 @@
+'''
+Measurement labels of the merged chip (EBeam.coords)
+
+The measurement labels of the submissions, the framework and the UBC
+logo are collected from the chip once it is built, each placed file in a
+single pass over its hierarchy, with their position on the chip.  The
+labels follow the format of the automated measurements:
+
+  opt_in_<polarization>_<wavelength>_<type>_<deviceID>_<params>
+  opt_<polarization>_<wavelength>_<type>_<deviceID>_<params>
+  elec_<deviceID>_<padName>_<params>
+  pwb_<recipeID>_<params>
+
+e.g., opt_in_TE_1550_device_LukasChrostowski_MZI1: type device, deviceID
+(the designer) LukasChrostowski, params MZI1.  The device name is the
+part after the type, LukasChrostowski_MZI1; for the elec and pwb labels,
+the part after the prefix.
+
+The index is written as EBeam.coords, in the format of
+SiEPIC.utils.find_automated_measurement_labels: a section for each kind
+of label, with the coordinates in um as integers and the missing fields
+as 'comment'.  The labels are the texts starting with the prefixes above,
+where find_automated_measurement_labels takes the texts containing them.
+It is also written as a table (CSV), and can be queried by label or
+device name, or by area of the chip.
+
+'''
+
+import csv
+
+import pya
+
+label_columns = ['label', 'kind', 'x', 'y', 'polarization', 'wavelength', 'type', 'deviceID', 'params',
+                 'device', 'file', 'course']
+
+# kinds of labels, by prefix
+label_kinds = [('opt_in_', 'opt_in'), ('opt_', 'opt_in'), ('elec_', 'elec'), ('pwb_', 'pwb')]
+
+
+def coords_fields(label):
+    '''
+    Fields of the label as in find_automated_measurement_labels: split on
+    '_', with 'opt_' read as 'opt_in_', and padded with 'comment' to 7
+    fields for the opt_in labels, 4 for the others
+    '''
+    if label.startswith('opt_') and not label.startswith('opt_in_'):
+        label = 'opt_in_' + label[len('opt_'):]
+    fields = label.split('_')
+    fields += ['comment'] * ((7 if label.startswith('opt_in_') else 4) - len(fields))
+    return fields
+
+
+def parse_label(label):
+    '''
+    Fields of a label, as a dict with kind (opt_in, elec or pwb, or None),
+    polarization, wavelength, type, deviceID (recipeID for pwb), params and
+    device; missing fields are empty
+    '''
+    kind = next((kind for prefix, kind in label_kinds if label.startswith(prefix)), None)
+    fields = label.split('_')
+    if kind == 'opt_in':
+        fields = fields[2:] if label.startswith('opt_in_') else fields[1:]
+        fields += [''] * (4 - len(fields))
+        return {'kind': kind, 'polarization': fields[0], 'wavelength': fields[1], 'type': fields[2],
+                'deviceID': fields[3], 'params': '_'.join(fields[4:]), 'device': '_'.join(fields[3:])}
+    fields = fields[1:] + [''] * (2 - len(fields))
+    return {'kind': kind, 'polarization': '', 'wavelength': '', 'type': '', 'deviceID': fields[0],
+            'params': '_'.join(fields[1:]), 'device': '_'.join(fields)}
+
+
+class LabelIndex:
+    '''
+    The measurement labels on the chip, with their position (x, y, in um) and
+    the file and course they belong to; by label and device name, and
+    bucketed on a uniform grid for the queries by area.
+    '''
+
+    def __init__(self, dbu=0.001, bin_size=500):
+        self.dbu = dbu
+        self.bin_size = bin_size
+        self.labels = []
+        self.by_name = {}
+        self.bins = {}
+
+    def add(self, label, x, y, file=None, course=None):
+        '''Add a label at x, y (in um)'''
+        entry = dict(parse_label(label), label=label, x=x, y=y, file=file, course=course)
+        self.labels.append(entry)
+        for name in {label, entry['device']}:
+            self.by_name.setdefault(name, []).append(entry)
+        self.bins.setdefault((int(x // self.bin_size), int(y // self.bin_size)), []).append(entry)
+        return entry
+
+    def add_cell(self, cell, layer_index, trans=pya.Trans(), file=None, course=None):
+        '''
+        Add the measurement labels on layer_index in the hierarchy of
+        cell, placed on the chip with trans
+        '''
+        if layer_index is None:
+            return
+        pattern = '{%s}*' % ','.join(prefix for prefix, kind in label_kinds)
+        texts = pya.Texts(cell.begin_shapes_rec(layer_index), pya.ICplxTrans(trans)).with_match(pattern, False)
+        for text in texts.each():
+            self.add(text.string, round(text.x * self.dbu, 3), round(text.y * self.dbu, 3), file, course)
+
+    def find(self, name):
+        '''Labels with the label or device name, e.g. LukasChrostowski_MZI1'''
+        return self.by_name.get(name, [])
+
+    def in_box(self, box):
+        '''Labels within the pya.DBox box (in um), e.g. the field of view of the probe station'''
+        b = self.bin_size
+        found = []
+        for i in range(int(box.left // b), int(box.right // b) + 1):
+            for j in range(int(box.bottom // b), int(box.top // b) + 1):
+                found += [entry for entry in self.bins.get((i, j), ())
+                          if box.contains(pya.DPoint(entry['x'], entry['y']))]
+        return found
+
+    def duplicates(self):
+        '''Labels found more than once on the chip'''
+        return sorted(label for label, entries in self.by_name.items()
+                      if len(entries) > 1 and entries[0]['label'] == label)
+
+    def write_coords(self, file_out):
+        '''
+        Coordinates file for the automated measurements, as the text of
+        find_automated_measurement_labels, with a line for each <br>
+        '''
+        with open(file_out, 'w') as f:
+            f.write('% X-coord, Y-coord, Polarization, wavelength, type, deviceID, params \n')
+            for entry in self.labels:
+                if entry['kind'] == 'opt_in':
+                    fields = coords_fields(entry['label'])
+                    f.write('%s, %s, %s, %s, %s, %s%s\n' % (int(entry['x']), int(entry['y']), fields[2],
+                        fields[3], fields[4], fields[5], ''.join(', ' + p for p in fields[6:])))
+            for kind, header in [('elec', 'deviceID, padName, params'), ('pwb', 'recipeID, params')]:
+                f.write('\n%% X-coord, Y-coord, %s \n' % header)
+                for entry in self.labels:
+                    if entry['kind'] == kind:
+                        fields = coords_fields(entry['label'])
+                        f.write('%s, %s, %s, %s%s\n' % (int(entry['x']), int(entry['y']), fields[1],
+                            fields[2], ''.join(', ' + p for p in fields[3:])))
+
+    def write_table(self, file_out):
+        '''CSV file of the labels, with label_columns'''
+        with open(file_out, 'w', newline='') as f:
+            writer = csv.DictWriter(f, label_columns)
+            writer.writeheader()
+            writer.writerows(self.labels)
@@ -0,0 +1,41 @@
+'''
+Library cells for the automated merge (EBeam_merge.py)
+
+The framework and the UBC logo are the same large layouts in every merge.
+Rather than reading them into a layout of their own and copying them into
+the chip, they are placed as empty ghost cells, using the extent and the
+Floorplan recorded in the normalized cache.  Their contents are read
+directly into the chip from the cached (uncompressed) OASIS blob just
+before it is written, filling the ghost cells.
+
+'''
+
+import pya
+
+
+def library_cell(layout, name):
+    '''
+    Empty ghost cell named as the top cell of a library layout; create it
+    before the submissions are copied, so the name is not taken
+    '''
+    cell = layout.create_cell(name)
+    cell.ghost_cell = True
+    return cell
+
+
+def expand_library_cells(layout, cells):
+    '''
+    Fill the library cells [(cell, source)] with their contents.
+    source: the OASIS blob, read into layout; or a Layout, copied.
+    Cells of the library with the name of a cell in layout are renamed.
+    '''
+    options = pya.LoadLayoutOptions()
+    options.cell_conflict_resolution = pya.LoadLayoutOptions.RenameCell
+    for cell, source in cells:
+        if isinstance(source, pya.Layout):
+            cell.ghost_cell = False
+            cell.copy_tree(source.cell(cell.name))
+        else:
+            layout.read_bytes(source, options)
+        if cell.ghost_cell:
+            raise RuntimeError('Library cell %s not found' % cell.name)
@@ -0,0 +1,330 @@
+'''
+Merge session: the chip layout of the automated merge, kept in memory
+
+EBeam_merge.py builds the chip with a MergeSession, placing every file in
+order.  A session can also be kept open, e.g., in a notebook or by a file
+watcher, to add, remove or update single submissions and export the chip
+again, without merging all the files:
+
+  session = MergeSession(merge_config, 'EBeam_2025_10')
+  for f in files:
+      session.add(f)
+  session.export('merge', 'EBeam')
+  session.update('submissions/EBeam_changed.gds')
+  session.remove('EBeam_withdrawn.gds')
+  session.export('merge', 'EBeam')
+
+An updated submission keeps its position if its new Floorplan fits
+there.  Otherwise, and for new submissions, the 'columns' packing
+continues from the last position, so the space of the removed cells is
+not used again, while the 'skyline' packing is lowered where cells were
+removed and fills the space above the remaining cells.  The chip can then
+differ from a full merge of the same files, which places every file in
+order.
+
+'''
+
+import os
+from datetime import datetime
+
+import pya
+
+from dedup import deduplicate_cells
+from export_profiles import export_chip
+from file_dates import file_dates
+from labels import LabelIndex
+from library_cells import library_cell, expand_library_cells
+from normalize import library_kinds, normalize_files
+from placement import find_position, SkylinePacking, FloorplanIndex
+
+# cell for each course, under the top cell
+course_cells = [('edXphot1x', 'edX'), ('ELEC413', 'ELEC413'),
+                ('SiEPIC_Passives', 'SiEPIC_Passives'), ('openEBL', 'openEBL')]
+
+# origin of the framework and UBC cells on the chip
+library_origins = {'framework': (0, 0), 'ubc': (8780000, 8780000)}
+
+
+class MergeSession:
+    '''
+    Chip layout, Floorplan index and placed files of a merge.
+
+    config: the merge configuration for normalize.normalize_submission,
+      with dbu, cell_Width, cell_Height, layer_text, ...
+    cell_Gap_Width, cell_Gap_Height: gaps between the submissions
+    chip_Height: height of the columns of submissions
+    packing: 'columns', the columns are filled in order, bottom-up, as
+      they always have been; or 'skyline' (placement.SkylinePacking),
+      which also keeps the cells within chip_Width and out of the obstacles
+    obstacles: [pya.Box] areas kept free by the 'skyline' packing, e.g., the PCM cutouts
+    layers_move: [[from layer, to layer]] moved when the chip is exported
+    cache: NormalizedCache for the files added with add() and update()
+    log: function called with each line for the merge log
+    plan: only place the files (EBeam_merge.py --plan), without their layouts
+    '''
+
+    def __init__(self, config, top_cell_name, cell_Gap_Width=8000, cell_Gap_Height=8000, chip_Height=8780000,
+                 packing='columns', chip_Width=8650000, obstacles=None,
+                 layers_move=None, cache=None, log=None, plan=False, now=None):
+        self.config = config
+        self.cell_Gap_Width = cell_Gap_Width
+        self.cell_Gap_Height = cell_Gap_Height
+        self.chip_Height = chip_Height
+        self.layers_move = layers_move or []
+        self.cache = cache
+        self.log = log or (lambda text: None)
+        self.plan = plan
+
+        # Output layout
+        self.layout = pya.Layout()
+        self.layout.dbu = config['dbu']
+        self.top_cell = self.layout.create_cell(top_cell_name)
+        self.layer_text = self.layout.layer(pya.LayerInfo.from_string(config['layer_text']))
+
+        # Create course cells using the folder name under the top cell
+        t = pya.Trans(pya.Trans.R0, 0, 0)
+        self.course_cells = {}
+        for course, name in course_cells:
+            self.course_cells[course] = self.layout.create_cell(name)
+            self.top_cell.insert(pya.CellInstArray(self.course_cells[course].cell_index(), t))
+
+        # Create a date stamp cell, and add a text label
+        now = now or datetime.now()
+        self.merge_stamp = '.merged:' + now.strftime("%Y-%m-%d-%H:%M:%S")
+        cell_date = self.layout.create_cell(self.merge_stamp)
+        cell_date.shapes(self.layout.layer(10, 0)).insert(pya.Text(self.merge_stamp, pya.Trans(pya.Trans.R0, 0, 0)))
+        self.top_cell.insert(pya.CellInstArray(cell_date.cell_index(), t))
+
+        # Origins for the layouts
+        self.x, self.y = 0, config['cell_Height'] + cell_Gap_Height
+        # Keep track of the width of the cells, for each column
+        self.max_cell_Width = 0
+        # Floorplans placed on the chip so far, for the overlap checks
+        self.fp_index = FloorplanIndex()
+        self.packing = None
+        if packing == 'skyline':
+            self.packing = SkylinePacking(self.fp_index, cell_Gap_Width, cell_Gap_Height, chip_Width, chip_Height, obstacles)
+        elif packing != 'columns':
+            raise ValueError('Unknown packing: %s' % packing)
+        # Framework and UBC cells, read into the chip before it is written
+        self.library_cells = []
+        # placed files, by file name, in order
+        self.placed = {}
+
+    def add(self, f, date=None, position=None):
+        '''
+        Normalize the file f and place it on the chip.
+        date: timestamp for the cell name; by default, the time of its last
+          commit, or its modification time
+        position: (x, y) to place a submission at, if it fits
+        Returns the placement record, or None if there is nothing to place
+        '''
+        if os.path.basename(f) in self.placed:
+            raise ValueError('%s is already placed; use update()' % os.path.basename(f))
+        if date is None:
+            date = file_dates([f])[f]
+        _, layout2, info = next(normalize_files([f], self.config, cache=self.cache, plan=self.plan))
+        return self.place(f, layout2, info, date, position=position)
+
+    def remove(self, name):
+        '''Remove the file name (without folder) from the chip; returns its placement record'''
+        record = self.placed.pop(name)
+        self.fp_index.remove(name)
+        self.library_cells = [(cell, source) for cell, source in self.library_cells
+                              if cell.cell_index() != record.get('library_cell')]
+        # the cells shared with other submissions are kept
+        self.layout.prune_cell(record['cell'].cell_index(), -1)
+        if self.packing and record['kind'] == 'submission':
+            # lower the skyline where the cell was
+            self.packing.rebuild([r['box'] for r in self.placed.values() if r['kind'] == 'submission'])
+        return record
+
+    def update(self, f, date=None):
+        '''
+        Place the new version of the file f, at the same position if it
+        fits; the framework and UBC are placed at their origin again
+        '''
+        record = self.placed.get(os.path.basename(f))
+        if record:
+            self.remove(os.path.basename(f))
+        return self.add(f, date, position=record.get('position') if record else None)
+
+    def place(self, f, layout2, info, date, timer=None, position=None):
+        '''
+        Place the normalized file f on the chip: layout2, info from
+        normalize.normalize_files; see add()
+        '''
+        lap = timer.lap if timer else lambda stage: None
+        layout = self.layout
+        basefilename = os.path.basename(f)
+
+        filedate = datetime.fromtimestamp(date).strftime("%Y%m%d_%H%M")
+        self.log("\nLoading: %s, dated %s" % (basefilename, filedate))
+
+        # Log from the normalization: course, DBU, top cell, layers, labels, clipping
+        for line in info['log']:
+            self.log(line)
+
+        record = {'kind': info['kind'], 'file': basefilename, 'info': info}
+
+        if info['kind'] in library_kinds:
+            # Create sub-cell using the filename under top cell
+            subcell2 = layout.create_cell(basefilename + "_" + filedate)
+            t = pya.Trans(pya.Trans.R0, *library_origins[info['kind']])
+            self.top_cell.insert(pya.CellInstArray(subcell2.cell_index(), t))
+            # library cell, filled when the chip is written
+            cell_library = library_cell(layout, info['cell'])
+            subcell2.insert(pya.CellInstArray(cell_library.cell_index(), pya.Trans()))
+            if layout2 is not None:
+                self.library_cells.append((cell_library, layout2))
+            record['library_cell'] = cell_library.cell_index()
+            record['trans'] = t
+            record['box'] = pya.Box(*info['bbox']).transformed(t)
+            record['floorplans'] = [pya.Polygon.from_s(p).transformed(t) for p in info['floorplans']]
+
+        elif info['kind'] == 'submission':
+            # Create sub-cell using the filename under course cell
+            subcell2 = layout.create_cell(basefilename + "_" + filedate)
+
+            # SiEPIC-Tools labels, removed from the user's cell
+            for text in info['siepic_texts']:
+                subcell2.shapes(self.layer_text).insert(pya.Text(text, 0, 0))
+
+            # bounding box of the cell, before and after clipping
+            bbox = pya.Box(*info['bbox'])
+            bbox2 = pya.Box(*info['bbox2'])
+
+            # Create sub-cell under subcell cell, using user's cell name
+            subcell = layout.create_cell(info['name'])
+            t0 = pya.Trans(pya.Trans.R0, -bbox.left, -bbox.bottom)
+            subcell2.insert(pya.CellInstArray(subcell.cell_index(), t0))
+
+            # Copy the cropped version
+            if layout2 is not None:
+                subcell.copy_tree(layout2.cell(info['cell']))
+                lap('copy_tree')
+
+            # Extent of subcell2, taken from the clipped cell rather than subcell2.bbox(),
+            # which would update the bounding boxes of the whole chip layout for every submission
+            bbox_subcell2 = bbox2.moved(-bbox.left, -bbox.bottom)
+
+            if position and (self.packing.fits(position[0], position[1], bbox2.width(), bbox2.height()) if self.packing else
+                             self.fp_index.is_free(pya.Box(position[0], position[1],
+                                                           position[0] + bbox2.width(), position[1] + bbox2.height()))):
+                x, y = position
+            elif self.packing:
+                (x, y), on_chip = self.packing.position(bbox2.width(), bbox2.height())
+                if not on_chip:
+                    self.log('  - WARNING: no space left on the chip')
+            else:
+                # Check if this cell would overlap with other Floorplans, then move if necessary
+                # Track the maximum width of the cells, for each column
+                self.max_cell_Width = max(self.max_cell_Width, bbox_subcell2.right)
+                self.x, self.y, self.max_cell_Width = find_position(self.fp_index, self.x, self.y,
+                    bbox2.width(), bbox2.height(), bbox_subcell2.top, self.max_cell_Width,
+                    self.cell_Gap_Height, self.cell_Gap_Width, self.chip_Height)
+                x, y = self.x, self.y
+                # Measure the height of the cell that was added, and move up
+                self.y += bbox2.height()
+
+            # Insert cell instance in the chip
+            t = pya.Trans(pya.Trans.R0, x, y)
+            self.course_cells[info['course']].insert(pya.CellInstArray(subcell2.cell_index(), t))
+            self.log('  - Placed at position: %s, %s' % (x, y))
+            record['position'] = (x, y)
+            record['trans'] = t
+            record['box'] = bbox_subcell2.transformed(t)
+            # the Floorplan of the clipped cell, from the normalization
+            record['floorplans'] = [pya.Polygon.from_s(p).transformed(t * t0) for p in info['floorplans']]
+
+        else:
+            return None
+
+        for polygon in record['floorplans']:
+            self.fp_index.insert_polygon(polygon, basefilename)
+        record['cell'] = subcell2
+        self.placed[basefilename] = record
+        lap('placement')
+        return record
+
+    def render_items(self):
+        '''[(DBox in um, key)] for the cells on the chip, for render.render_png'''
+        dbu = self.layout.dbu
+        return [(pya.DBox(0, 0, 0, 0), self.merge_stamp)] + \
+            [(record['box'].to_dtype(dbu), record['info'].get('key')) for record in self.placed.values()]
+
+    def plan_rows(self):
+        '''Placement table of the submissions, for plan.write_table'''
+        rows = []
+        for record in self.placed.values():
+            if record['kind'] == 'submission':
+                info = record['info']
+                box = record['box'].to_dtype(self.layout.dbu)
+                rows.append({'file': record['file'], 'course': info['course'], 'cell': info['name'],
+                             'x': box.left, 'y': box.bottom, 'width': box.width(), 'height': box.height(),
+                             'clipped': info['bbox'] != info['bbox2'], 'labels': len(info['labels'])})
+        return rows
+
+    def library_floorplans(self):
+        '''Floorplans of the framework and UBC, for plan.write_svg'''
+        return [p for record in self.placed.values() if record['kind'] in library_kinds for p in record['floorplans']]
+
+    def fill_library_cells(self, timer=None):
+        '''Fill the framework and UBC cells with their contents, if not done yet'''
+        if self.library_cells:
+            expand_library_cells(self.layout, self.library_cells)
+            self.library_cells = []
+            if timer:
+                timer.lap('library_cells')
+
+    def labels(self, timer=None):
+        '''
+        LabelIndex of the measurement labels on the chip, of the submissions,
+        the framework and the UBC logo; fills the library cells
+        '''
+        self.fill_library_cells(timer)
+        index = LabelIndex(dbu=self.layout.dbu)
+        for record in self.placed.values():
+            index.add_cell(record['cell'], self.layer_text, record['trans'], record['file'], record['info']['course'])
+        if timer:
+            timer.lap('labels')
+        return index
+
+    def export(self, path, filename, profile='compact', dedup=True, timer=None):
+        '''
+        Write the chip to path/filename with the export profile, after
+        filling the library cells and sharing the identical cells.
+        Returns the file name, the export stats and the dedup stats
+        '''
+        lap = timer.lap if timer else lambda stage: None
+        layout = self.layout
+
+        # Contents of the framework and UBC cells
+        self.fill_library_cells(timer)
+
+        # Share the identical cells between the submissions, e.g., the PDK cells,
+        # so they are stored once in memory and in the output file
+        dedup_stats = None
+        if dedup:
+            dedup_stats = deduplicate_cells(layout)
+            self.log('')
+            self.log('Cell deduplication: %s identical cells removed, with %s shapes and %s instances'
+                     % (dedup_stats['cells'], dedup_stats['shapes'], dedup_stats['instances']))
+            lap('dedup')
+
+        # move layers
+        for layer1, layer2 in self.layers_move:
+            layer1 = layout.find_layer(*layer1)
+            layer2 = layout.find_layer(*layer2)
+            if layer1 is not None and layer2 is not None:
+                layout.move_layer(layer1, layer2)
+
+        # Export as-is layout, for UW fabrication
+        self.log('')
+        file_out, export_stats = export_chip(self.top_cell, path, filename, profile=profile)
+        self.log("Layout exported (%s profile): %s, %.2f MB, in %.2f seconds"
+                 % (profile, os.path.basename(file_out), export_stats['bytes']/1e6, export_stats['seconds']))
+        if dedup_stats:
+            self.log('  - %.2f MB saved by the cell deduplication' % (dedup_stats['bytes']/1e6))
+        lap('export')
+        return file_out, export_stats, dedup_stats
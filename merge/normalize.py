@@ -0,0 +1,359 @@
+'''
+Per-file normalization for the automated merge (EBeam_merge.py)
+
+Loads one GDS/OAS file and prepares it for placement on the chip:
+ - correct the database unit
+ - only keep the layers in layers_keep, and log the others
+ - find the top cell
+ - clean up the text layer
+ - clip the layout to the allocated area
+
+This only works on the file's own layout, so it can run in worker
+processes (EBeam_merge.py --jobs N), and its result can be cached
+(normalized_cache.py).  The merge then only places the normalized cells
+and copies them into the chip.
+
+'''
+
+import mmap
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+import pya
+
+from export_profiles import save_options
+from perf import StageTimer, peak_rss
+
+# files placed as library cells: the framework and the UBC logo
+library_kinds = ('framework', 'ubc')
+
+
+def course_name(basefilename):
+    '''Course / workshop, from the submission file name'''
+    if 'elec413' in basefilename.lower():
+        return 'ELEC413'
+    elif 'openebl' in basefilename.lower():
+        return 'openEBL'
+    elif 'siepic_passives' in basefilename.lower():
+        return 'SiEPIC_Passives'
+    elif 'ebeam' in basefilename.lower():
+        return 'edXphot1x'
+    else:
+        return 'openEBL'
+
+
+def layers_keep_options(layers_keep):
+    '''
+    Options to only read the layers in layers_keep; the shapes on other
+    layers are skipped by the reader
+    '''
+    layer_map = pya.LayerMap()
+    for i, l in enumerate(layers_keep):
+        layer_map.map(pya.LayerInfo.from_string(l), i)
+    options = pya.LoadLayoutOptions()
+    options.set_layer_map(layer_map, False)
+    return options
+
+
+def gds_layers(f):
+    '''
+    Layers (layer, datatype) of the shapes and texts in the GDS file f,
+    from a scan of its records, without reading the layout; None if f is
+    not a GDS file
+    '''
+    with open(f, 'rb') as fh:
+        # HEADER record
+        if fh.read(4) != b'\x00\x06\x00\x02':
+            return None
+        data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    layers = set()
+    layer = None
+    i = 0
+    with data:
+        while i + 6 <= len(data):
+            length, record = struct.unpack_from('>HH', data, i)
+            if length < 4:
+                break
+            if record == 0x0D02:
+                # LAYER
+                layer = struct.unpack_from('>H', data, i + 4)[0]
+            elif record in (0x0E02, 0x1602, 0x2E02):
+                # DATATYPE, TEXTTYPE, BOXTYPE
+                layers.add((layer, struct.unpack_from('>H', data, i + 4)[0]))
+            i += length
+    return layers
+
+
+def box_to_tuple(box):
+    return (box.left, box.bottom, box.right, box.top)
+
+
+def normalize_submission(f, config, plan=False):
+    '''
+    Load the layout in file f and normalize it for the merge.
+
+    config: dict with the merge configuration: dbu, layers_keep, layer_text,
+      layer_SEM, layer_SEM_allow, cell_Width, cell_Height, log_siepictools,
+      framework_file, ubc_file
+    plan: for EBeam_merge.py --plan, which only needs the info: the file
+      is read and clipped as for the merge, so that the bounding boxes
+      and Floorplans are exact, and layout2 is None.
+
+    Returns layout2, info; info is a dict with:
+     - kind: 'framework', 'ubc', 'submission', or None if there is nothing to place
+     - course: course name
+     - cell: name of the cell in layout2 to copy into the chip
+     - name: name of the user's top cell
+     - bbox, bbox2: bounding box of the top cell, before and after clipping,
+       as (left, bottom, right, top)
+     - floorplans: Floorplan (99/0) polygons of the cell, after clipping,
+       as strings
+     - siepic_texts: SiEPIC-Tools labels removed from the layout
+     - labels: opt_in measurement labels
+     - log: lines for the merge log file
+     - perf: time spent in each stage, in seconds, and peak memory (rss_kB)
+    '''
+    basefilename = os.path.basename(f)
+    dbu = config['dbu']
+    layer_text = config['layer_text']
+    info = {'kind': None, 'course': None, 'cell': None, 'name': None,
+            'bbox': None, 'bbox2': None, 'floorplans': [], 'siepic_texts': [], 'labels': [], 'log': []}
+    log = info['log'].append
+    timer = StageTimer()
+
+    course = course_name(basefilename)
+    info['course'] = course
+
+    # Load layout; for submissions, only the layers that are kept are read:
+    # the GDS reader skips the other layers, which are listed from the
+    # records of the file; OASIS files are read whole, as the layers are
+    # only known once read, and the other layers are deleted
+    layout2 = pya.Layout()
+    layers_keep = config['layers_keep'] + ([config['layer_SEM']] if course in config['layer_SEM_allow'] else [])
+    layers_skipped = []
+    if basefilename in [config['framework_file'], config['ubc_file']]:
+        layout2.read(f)
+    else:
+        keep = set((li.layer, li.datatype) for li in map(pya.LayerInfo.from_string, layers_keep))
+        layers_file = gds_layers(f)
+        if layers_file is not None:
+            layers_read = layout2.read(f, layers_keep_options(layers_keep))
+            # the layer map creates all the layers in layers_keep, including the ones not in the file
+            for li in layout2.layer_infos():
+                if not layers_read.is_mapped(li):
+                    layout2.delete_layer(layout2.find_layer(li))
+            layers_skipped = ['%s/%s' % layer for layer in sorted(layers_file - keep)]
+        else:
+            layout2.read(f)
+            for li in layout2.layer_infos():
+                if (li.layer, li.datatype) not in keep:
+                    layers_skipped.append(li.to_s())
+                    layout2.delete_layer(layout2.find_layer(li))
+    timer.lap('read')
+
+    log("  - course name: %s" % (course) )
+
+    # Check the DBU Database Unit, in case someone changed it, e.g., 5 nm, or 0.1 nm.
+    if round(layout2.dbu,10) != dbu:
+        log('  - WARNING: The database unit (%s dbu) in the layout does not match the required dbu of %s.' % (layout2.dbu, dbu))
+        print('  - WARNING: The database unit (%s dbu) in the layout does not match the required dbu of %s.' % (layout2.dbu, dbu))
+        # Step 1: change the DBU to match, but that magnifies the layout
+        wrong_dbu = layout2.dbu
+        layout2.dbu = dbu
+        # Step 2: scale the layout
+        try:
+            # determine the scaling required
+            scaling = round(wrong_dbu / dbu, 10)
+            layout2.transform (pya.ICplxTrans(scaling, 0, False, 0, 0))
+            log('  - WARNING: Database resolution has been corrected and the layout scaled by %s' % scaling)
+        except:
+            print('ERROR IN EBeam_merge.py: Incorrect DBU and scaling unsuccessful')
+    timer.lap('dbu')
+
+    # check that there is one top cell in the layout
+    num_top_cells = len(layout2.top_cells())
+    if num_top_cells > 1:
+        log('  - layout should only contain one top cell; contains (%s): %s' % (num_top_cells, [c.name for c in layout2.top_cells()]) )
+    if num_top_cells == 0:
+        log('  - layout does not contain a top cell')
+
+    # Find the top cell
+    for cell in layout2.top_cells():
+        if basefilename in [config['framework_file'], config['ubc_file']]:
+            info['kind'] = 'framework' if basefilename == config['framework_file'] else 'ubc'
+            info['cell'] = cell.name
+            # the merge places these as library cells, using their extent
+            # and Floorplan, and only reads the layout when the chip is written
+            info['bbox'] = box_to_tuple(cell.bbox())
+            layer_index = layout2.find_layer(99,0)
+            if layer_index is not None:
+                info['floorplans'] = [p.to_s() for p in pya.Region(cell.begin_shapes_rec(layer_index)).each()]
+            timer.lap('floorplan')
+            break
+
+        if num_top_cells == 1 or cell.name.lower() == 'top' or cell.name.lower() == 'EBeam_':
+            log("  - top cell: %s" % cell.name)
+
+            # check layout height
+            if cell.bbox().top < cell.bbox().bottom:
+                log(' - WARNING: empty layout. Skipping.')
+                break
+
+            # Extra layers were not loaded
+            for li in layout2.layer_infos():
+                log('  - loading layer: %s' % li.to_s())
+            for layer in layers_skipped:
+                log('  - deleting layer: %s' % layer)
+            timer.lap('layers')
+
+            # Delete non-text geometries in the Text layer
+            # and move the SiEPIC-Tools labels out of the user's cell
+            layer_index = layout2.find_layer(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
+            if type(layer_index) != type(None):
+                # labels as seen from the top cell, in hierarchical order;
+                # only the texts are collected, not the other geometries
+                texts = pya.Texts(cell.begin_shapes_rec(layer_index))
+                for text in texts.each():
+                    if text.string.startswith('SiEPIC-Tools'):
+                        if config['log_siepictools']:
+                            log('  - text %s' % text )
+                        info['siepic_texts'].append(text.string)
+                    elif text.string.startswith('opt_in'):
+                        log('  - measurement label: %s' % text.string )
+                        info['labels'].append(text.string)
+                # clean up each cell in the hierarchy once, keeping the texts
+                # other than the SiEPIC-Tools labels
+                for ci in [cell.cell_index()] + list(cell.called_cells()):
+                    shapes = layout2.cell(ci).shapes(layer_index)
+                    if shapes.is_empty():
+                        continue
+                    texts_keep = pya.Texts(shapes).with_match('SiEPIC-Tools*', True)
+                    if texts_keep.count() != shapes.size():
+                        shapes.clear()
+                        shapes.insert(texts_keep)
+            timer.lap('text')
+
+            # bounding box of the cell
+            bbox = cell.bbox()
+            log('  - bounding box: %s' % bbox.to_s() )
+
+            # clip / crop cells
+            clip_box = pya.Box(bbox.left,bbox.bottom,bbox.left+config['cell_Width'],bbox.bottom+config['cell_Height'])
+            if bbox.inside(clip_box):
+                # fits the allocated area: nothing to clip
+                cell2 = cell.cell_index()
+                bbox2 = bbox
+            else:
+                # clip is hierarchical: only the cells crossing the edge of
+                # the clip box are split into clipped variants
+                cell2 = layout2.clip(cell.cell_index(), clip_box)
+                bbox2 = layout2.cell(cell2).bbox()
+            if bbox != bbox2:
+                log('  - WARNING: Cell was clipped to maximum size of %s X %s' % (config['cell_Width'], config['cell_Height']) )
+                log('  - clipped bounding box: %s' % bbox2.to_s() )
+            timer.lap('clip')
+
+            info['kind'] = 'submission'
+            info['cell'] = layout2.cell(cell2).name
+            info['name'] = cell.name
+            info['bbox'] = box_to_tuple(bbox)
+            info['bbox2'] = box_to_tuple(bbox2)
+            layer_index = layout2.find_layer(99,0)
+            if layer_index is not None:
+                floorplans = pya.Region(layout2.cell(cell2).begin_shapes_rec(layer_index))
+                info['floorplans'] = [p.to_s() for p in floorplans.each()]
+
+    info['perf'] = dict(timer.stages, rss_kB=peak_rss())
+    return None if plan else layout2, info
+
+
+def normalize_submission_oas(f, config):
+    '''
+    normalize_submission, for worker processes:
+    returns the normalized cell as an OASIS blob, and the info dict.
+    The framework and UBC blobs are uncompressed, as they are read on
+    every merge
+    '''
+    layout2, info = normalize_submission(f, config)
+    if info['kind'] is None:
+        return None, info
+    if info['kind'] in library_kinds:
+        options, _ = save_options('fast')
+    else:
+        options = pya.SaveLayoutOptions()
+        options.format = 'OASIS'
+    options.select_cell(layout2.cell(info['cell']).cell_index())
+    return layout2.write_bytes(options), info
+
+
+def plan_submission(f, config):
+    '''normalize_submission for EBeam_merge.py --plan without the cache, for worker processes'''
+    return normalize_submission(f, config, plan=True)
+
+
+def read_normalized(blob, info):
+    '''Layout from an OASIS blob returned by normalize_submission_oas'''
+    layout2 = pya.Layout()
+    if blob is not None:
+        layout2.read_bytes(blob)
+    return layout2, info
+
+
+def normalize_files(files, config, jobs=1, cache=None, plan=False):
+    '''
+    Generator of (f, layout2, info), with layout2, info from
+    normalize_submission, for each file f in files, in order.
+    For the framework and UBC, layout2 may be the OASIS blob instead,
+    which the merge reads into the chip when it is written (library_cells.py).
+
+    jobs: number of worker processes; the workers return the normalized
+      cells as OASIS blobs
+    cache: NormalizedCache; files found in the cache are not normalized again
+    plan: only the info is needed (EBeam_merge.py --plan): layout2 is None,
+      and the cached blobs are not read; the other files are normalized
+      and cached as for the merge, which then finds them in the cache
+    '''
+    if jobs > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+        # worker processes started with "spawn" would re-run the merge script
+        print('Parallel mode requires the "fork" start method; running with --jobs 1')
+        jobs = 1
+
+    keys = [cache.key(f, config) if cache else None for f in files]
+    cached = [cache.get(key, blob=not plan) if cache else None for key in keys]
+    files_todo = [f for f, entry in zip(files, cached) if entry is None]
+    if cache:
+        print('Normalized submissions cache: %s cached, %s to process' % (len(files) - len(files_todo), len(files_todo)))
+
+    executor = None
+    if jobs > 1 and len(files_todo) > 1:
+        print('Normalizing the submissions using %s worker processes' % jobs)
+        executor = ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('fork'))
+        results = executor.map(plan_submission if plan and not cache else normalize_submission_oas, files_todo, [config]*len(files_todo))
+    elif cache:
+        results = (normalize_submission_oas(f, config) for f in files_todo)
+    elif plan:
+        results = (plan_submission(f, config) for f in files_todo)
+    else:
+        results = (normalize_submission(f, config) for f in files_todo)
+
+    try:
+        for f, key, entry in zip(files, keys, cached):
+            if entry is None:
+                entry = next(results)
+                if cache:
+                    cache.put(key, *entry)
+                entry[1]['cached'] = False
+            else:
+                entry[1]['cached'] = True
+            entry[1]['key'] = key
+            if plan:
+                yield f, None, entry[1]
+            elif isinstance(entry[0], pya.Layout) or entry[1]['kind'] in library_kinds:
+                yield (f,) + entry
+            else:
+                yield (f,) + read_normalized(*entry)
+    finally:
+        if executor:
+            executor.shutdown()
@@ -0,0 +1,159 @@
+'''
+On-disk cache of normalized submissions, for incremental merges
+
+Each entry holds the normalized cell of one file, as an OASIS blob
+(<key>.oas), and its info dict including the log lines (<key>.json).
+The key is a hash of:
+ - the file content and name (the name sets the course)
+ - the merge configuration used by the normalization
+ - the KLayout version, and the normalization code and the save options
+   of the blobs (export_profiles.py)
+
+Entries are checked against the SHA-256 of the blob when they are read.
+When the cache grows beyond max_size, the least recently used entries are
+removed.
+
+'''
+
+import hashlib
+import json
+import os
+
+import pya
+
+import export_profiles
+import normalize
+
+# Increment when the format of the entries changes
+cache_version = 2
+
+
+def klayout_version():
+    version = getattr(pya, '__version__', None)
+    if not version:
+        version = pya.Application.instance().version()
+    return version
+
+
+class NormalizedCache:
+    '''
+    Cache of (blob, info) from normalize.normalize_submission_oas
+    '''
+
+    def __init__(self, folder, max_size=500*1024*1024):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+        # tool versions, normalization code and save options of the blobs
+        h = hashlib.sha256()
+        h.update(('%s %s' % (cache_version, klayout_version())).encode())
+        for module in [normalize, export_profiles]:
+            with open(module.__file__, 'rb') as fh:
+                h.update(fh.read())
+        self.tools_hash = h.hexdigest()
+
+    def key(self, f, config):
+        '''Cache key for the file f normalized with config'''
+        h = hashlib.sha256()
+        h.update(self.tools_hash.encode())
+        h.update(json.dumps(config, sort_keys=True).encode())
+        h.update(os.path.basename(f).encode())
+        with open(f, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1024*1024), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.folder, key + '.oas'), os.path.join(self.folder, key + '.json')
+
+    def _read(self, key, read_blob=True):
+        '''(blob, info) for key, or None if missing or corrupt; read_blob=False: (None, info)'''
+        file_oas, file_json = self._paths(key)
+        try:
+            with open(file_json) as fh:
+                entry = json.load(fh)
+            blob = None
+            if entry['sha256'] is not None and read_blob:
+                with open(file_oas, 'rb') as fh:
+                    blob = fh.read()
+                if hashlib.sha256(blob).hexdigest() != entry['sha256']:
+                    return None
+            info = entry['info']
+            # JSON has no tuples
+            for k in ['bbox', 'bbox2']:
+                if info[k] is not None:
+                    info[k] = tuple(info[k])
+            return blob, info
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def get(self, key, blob=True):
+        '''(blob, info) for key, or None on a miss; blob=False: only the info, (None, info)'''
+        entry = self._read(key, blob)
+        if entry is None:
+            self.remove(key)
+            return None
+        # mark as recently used
+        os.utime(self._paths(key)[1])
+        return entry
+
+    def put(self, key, blob, info):
+        '''Store (blob, info) for key, then evict entries beyond max_size'''
+        file_oas, file_json = self._paths(key)
+        if blob is not None:
+            with open(file_oas + '.tmp', 'wb') as fh:
+                fh.write(blob)
+            os.replace(file_oas + '.tmp', file_oas)
+        entry = {'sha256': hashlib.sha256(blob).hexdigest() if blob is not None else None,
+                 'info': info}
+        # write the index last, so that an interrupted write is a miss
+        with open(file_json + '.tmp', 'w') as fh:
+            json.dump(entry, fh)
+        os.replace(file_json + '.tmp', file_json)
+        self.evict()
+
+    def remove(self, key):
+        for p in self._paths(key):
+            if os.path.exists(p):
+                os.remove(p)
+
+    def entries(self):
+        '''[(last used, size, key)] for the entries in the cache'''
+        entries = []
+        for p in os.listdir(self.folder):
+            if p.endswith('.json'):
+                key = p[:-5]
+                file_oas, file_json = self._paths(key)
+                size = os.path.getsize(file_json)
+                if os.path.exists(file_oas):
+                    size += os.path.getsize(file_oas)
+                entries.append((os.path.getmtime(file_json), size, key))
+        return entries
+
+    def evict(self):
+        '''Remove the least recently used entries until the cache fits in max_size'''
+        entries = sorted(self.entries())
+        size = sum(e[1] for e in entries)
+        while entries and size > self.max_size:
+            _, s, key = entries.pop(0)
+            self.remove(key)
+            size -= s
+
+    def check(self):
+        '''
+        Verify every entry, and remove the corrupt ones and orphaned blobs.
+        Returns the number of valid and removed entries
+        '''
+        valid, removed = 0, 0
+        for _, _, key in self.entries():
+            if self._read(key) is None:
+                self.remove(key)
+                removed += 1
+            else:
+                valid += 1
+        for p in os.listdir(self.folder):
+            if p.endswith('.tmp') or (p.endswith('.oas') and not os.path.exists(os.path.join(self.folder, p[:-4] + '.json'))):
+                os.remove(os.path.join(self.folder, p))
+                removed += 1
+        return valid, removed
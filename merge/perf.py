@@ -0,0 +1,50 @@
+'''
+Timing and memory instrumentation for the automated merge (EBeam_merge.py)
+
+The merge records the time spent in each stage, per file and for the
+whole chip, and writes them with peak memory samples to EBeam.perf.json.
+
+'''
+
+import time
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+import sys
+
+
+def peak_rss():
+    '''Peak resident memory of this process, in kB, or None if unknown'''
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kB on Linux
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+class StageTimer:
+    '''
+    Accumulates the time between calls to lap() into named stages
+
+    timer = StageTimer()
+    ... read ...
+    timer.lap('read')
+    '''
+
+    def __init__(self):
+        self.stages = {}
+        self.t = time.time()
+
+    def lap(self, stage):
+        '''Add the time since the previous lap to stage'''
+        now = time.time()
+        self.stages[stage] = self.stages.get(stage, 0) + now - self.t
+        self.t = now
+
+    def skip(self):
+        '''Restart without counting the time since the previous lap'''
+        self.t = time.time()
@@ -0,0 +1,248 @@
+'''
+Placement helpers for the automated merge (EBeam_merge.py)
+
+The merge places each submission on the chip by searching for a position
+where its Floorplan (99/0) does not interact with any Floorplan already on
+the chip (framework, UBC logo, previous submissions).
+
+Rather than collecting a Region of every Floorplan shape on the chip for
+each new submission, the placed Floorplans are kept in a FloorplanIndex,
+which is updated as each cell is inserted, and which only tests the shapes
+in the grid bins that the candidate box covers.
+
+Two packings:
+ - columns (find_position): the columns are filled bottom-up, in order
+ - skyline (SkylinePacking, EBeam_merge.py --packing skyline): bottom-left
+   packing, within the chip and around obstacles such as the PCM cutouts
+
+'''
+
+import pya
+
+
+class FloorplanIndex:
+    '''
+    Occupancy index of Floorplan shapes, bucketed on a uniform grid.
+
+    Each shape is stored as its bounding box, plus the polygon itself if the
+    shape is not a rectangle.  Interaction follows pya.Region.interacting:
+    shapes that overlap or touch the query box are considered interacting.
+    '''
+
+    def __init__(self, bin_size=500000):
+        self.bin_size = bin_size
+        self.bins = {}
+        self.count = 0
+
+    def _bin_range(self, left, bottom, right, top):
+        b = self.bin_size
+        for i in range(left // b, right // b + 1):
+            for j in range(bottom // b, top // b + 1):
+                yield (i, j)
+
+    def insert_polygon(self, polygon, owner=None):
+        '''
+        Add a pya.Polygon (in chip coordinates) to the index; owner
+        identifies the shapes for remove()
+        '''
+        bbox = polygon.bbox()
+        entry = (bbox.left, bbox.bottom, bbox.right, bbox.top,
+                 None if polygon.is_box() else polygon, owner)
+        for key in self._bin_range(bbox.left, bbox.bottom, bbox.right, bbox.top):
+            self.bins.setdefault(key, []).append(entry)
+        self.count += 1
+
+    def insert_box(self, box, owner=None):
+        '''Add a pya.Box (in chip coordinates) to the index'''
+        self.insert_polygon(pya.Polygon(box), owner)
+
+    def remove(self, owner):
+        '''Remove the shapes added with owner'''
+        removed = set()
+        for key, entries in self.bins.items():
+            kept = [entry for entry in entries if entry[5] != owner]
+            if len(kept) != len(entries):
+                # each entry is in every bin it covers: count it once
+                removed.update(id(entry) for entry in entries if entry[5] == owner)
+                self.bins[key] = kept
+        self.count -= len(removed)
+
+    def insert_cell(self, cell, layer_index, trans=pya.Trans()):
+        '''
+        Add all the non-text shapes on layer_index found in the hierarchy
+        of cell, placed in the chip with trans
+        '''
+        if layer_index is None:
+            return
+        trans = pya.ICplxTrans(trans)
+        iter1 = cell.begin_shapes_rec(layer_index)
+        while not iter1.at_end():
+            if not iter1.shape().is_text():
+                self.insert_polygon(iter1.shape().polygon.transformed(trans * iter1.trans()))
+            iter1.next()
+
+    def is_free(self, box):
+        '''True if box does not overlap or touch any shape in the index'''
+        left, bottom, right, top = box.left, box.bottom, box.right, box.top
+        for key in self._bin_range(left, bottom, right, top):
+            for l, b, r, t, polygon, owner in self.bins.get(key, ()):
+                if l > right or r < left or b > top or t < bottom:
+                    continue
+                if polygon is None or polygon.touches(box):
+                    return False
+        return True
+
+    def interacting_top(self, box):
+        '''
+        None if box does not overlap or touch any shape in the index;
+        otherwise the top of the highest rectangle it interacts with, or
+        box.bottom if it only interacts with other polygons.
+        The box moved up to any height up to that top still interacts
+        with the rectangle.
+        '''
+        left, bottom, right, top = box.left, box.bottom, box.right, box.top
+        found = None
+        for key in self._bin_range(left, bottom, right, top):
+            for l, b, r, t, polygon, owner in self.bins.get(key, ()):
+                if l > right or r < left or b > top or t < bottom:
+                    continue
+                if polygon is None:
+                    found = t if found is None else max(found, t)
+                elif polygon.touches(box):
+                    found = bottom if found is None else found
+        return found
+
+
+def next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height, cell_top, max_cell_Width):
+    '''
+    Move up by one gap; when the cell no longer fits in the column, start
+    at the bottom of the next column.
+    '''
+    y += cell_Gap_Height
+    if y + cell_top > chip_Height:
+        y = 0
+        x += max_cell_Width + cell_Gap_Width
+        max_cell_Width = 0
+    return x, y, max_cell_Width
+
+
+def find_position(fp_index, x, y, width, height, cell_top, max_cell_Width,
+                  cell_Gap_Height, cell_Gap_Width, chip_Height):
+    '''
+    Find the next position, starting from (x, y), where a width x height
+    Floorplan does not interact with the Floorplans in fp_index.
+    Returns x, y, max_cell_Width
+
+    The search moves up in steps of cell_Gap_Height, and jumps directly
+    over the rectangles in the way: the positions are the same as with
+    single steps.
+    '''
+    x, y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height, cell_top, max_cell_Width)
+    while True:
+        blocking_top = fp_index.interacting_top(pya.Box(x, y, x + width, y + height))
+        if blocking_top is None:
+            return x, y, max_cell_Width
+        # every step up to blocking_top interacts: skip them
+        y += (blocking_top - y) // cell_Gap_Height * cell_Gap_Height
+        x, y, max_cell_Width = next_position(x, y, cell_Gap_Height, cell_Gap_Width, chip_Height, cell_top, max_cell_Width)
+
+
+class SkylinePacking:
+    '''
+    Bottom-left skyline packing: the skyline is the top of the cells
+    placed so far, across the chip, as [x_left, x_right, y] segments.
+    Each cell is placed at the lowest position, then the leftmost, among
+    the left ends of the segments, so narrower cells sit side by side.
+
+    The Floorplans in fp_index (framework, UBC, placed cells) and the
+    obstacles (e.g., the PCM cutouts) are avoided, with at least the gaps
+    between them, and the cells are kept within the chip
+    (chip_Width x chip_Height).  The search jumps over the rectangles in
+    the way, so it does not depend on the chip height.
+    '''
+
+    def __init__(self, fp_index, cell_Gap_Width, cell_Gap_Height, chip_Width, chip_Height, obstacles=None):
+        self.fp_index = fp_index
+        self.cell_Gap_Width = cell_Gap_Width
+        self.cell_Gap_Height = cell_Gap_Height
+        self.chip_Width = chip_Width
+        self.chip_Height = chip_Height
+        for box in obstacles or []:
+            fp_index.insert_box(box)
+        self.skyline = [[0, chip_Width, 0]]
+        # cells that do not fit on the chip, in a column past its right edge
+        self.overflow = [chip_Width + cell_Gap_Width, 0, 0]
+
+    def _query(self, x, y, width, height):
+        '''Box of a cell at x, y enlarged by the gaps, less one, as touching shapes interact'''
+        gw, gh = self.cell_Gap_Width - 1, self.cell_Gap_Height - 1
+        return pya.Box(x - gw, y - gh, x + width + gw, y + height + gh)
+
+    def fits(self, x, y, width, height):
+        '''True if a width x height cell at x, y is clear of the Floorplans, with the gaps'''
+        return self.fp_index.is_free(self._query(x, y, width, height))
+
+    def lowest_position(self, x, y, width, height):
+        '''Lowest y, from y up, where a width x height cell fits at x, or None'''
+        while y + height <= self.chip_Height:
+            blocking_top = self.fp_index.interacting_top(self._query(x, y, width, height))
+            if blocking_top is None:
+                return y
+            # above the rectangle in the way, or one gap up for other polygons
+            gh = self.cell_Gap_Height - 1
+            y = blocking_top + gh + 1 if blocking_top > y - gh else y + self.cell_Gap_Height
+        return None
+
+    def position(self, width, height):
+        '''
+        Position (x, y) for a width x height cell, and whether it is on the
+        chip; a cell that does not fit is placed in a column past the
+        right edge of the chip
+        '''
+        best = None
+        for i, (x, _, _) in enumerate(self.skyline):
+            if x + width > self.chip_Width:
+                break
+            # resting on the highest segment under the cell
+            y = max(segment[2] for segment in self.skyline[i:] if segment[0] < x + width)
+            if best is not None and y > best[0]:
+                continue
+            y = self.lowest_position(x, y, width, height)
+            if y is not None and (best is None or (y, x) < best):
+                best = (y, x)
+
+        if best is None:
+            x, y, column_width = self.overflow
+            if y and y + height > self.chip_Height:
+                x, y, column_width = x + column_width + self.cell_Gap_Width, 0, 0
+            self.overflow = [x, y + height + self.cell_Gap_Height, max(column_width, width)]
+            return (x, y), False
+
+        y, x = best
+        self._raise_skyline(x, x + width + self.cell_Gap_Width, y + height + self.cell_Gap_Height)
+        return (x, y), True
+
+    def rebuild(self, boxes):
+        '''
+        Skyline of the cells placed at the boxes, e.g., after one is
+        removed, so the space above the remaining cells is used again.
+        The column of the cells past the right edge of the chip is kept.
+        '''
+        self.skyline = [[0, self.chip_Width, 0]]
+        for box in sorted(boxes, key=lambda box: box.top):
+            if box.left < self.chip_Width:
+                self._raise_skyline(box.left, box.right + self.cell_Gap_Width, box.top + self.cell_Gap_Height)
+
+    def _raise_skyline(self, left, right, y):
+        '''Set the skyline to y from left to right'''
+        right = min(right, self.chip_Width)
+        skyline = [[l, min(r, left), h] for l, r, h in self.skyline if l < left]
+        skyline.append([left, right, y])
+        skyline += [[max(l, right), r, h] for l, r, h in self.skyline if r > right]
+        # merge the neighbouring segments at the same height
+        self.skyline = []
+        for segment in skyline:
+            if self.skyline and self.skyline[-1][2] == segment[2]:
+                self.skyline[-1][1] = segment[1]
+            else:
+                self.skyline.append(segment)
@@ -0,0 +1,72 @@
+'''
+Placement plan for the automated merge (EBeam_merge.py --plan)
+
+Writes where each file would be placed on the chip, without building the
+chip layout:
+ - a table (CSV): file, course, top cell, position and size in um,
+   whether the cell is clipped, and the number of measurement labels
+ - an overview (SVG): the Floorplans of the framework and UBC logo, and
+   the extent of each submission, coloured by course; clipped cells are
+   outlined in red
+
+'''
+
+import csv
+import html
+
+import pya
+
+course_colors = {
+    'edXphot1x': '#4e79a7',
+    'ELEC413': '#f28e2b',
+    'SiEPIC_Passives': '#59a14f',
+    'openEBL': '#b07aa1',
+}
+
+table_columns = ['file', 'course', 'cell', 'x', 'y', 'width', 'height', 'clipped', 'labels']
+
+
+def write_table(file_out, rows):
+    '''CSV file of the placed cells, rows: [dict with table_columns]'''
+    with open(file_out, 'w', newline='') as f:
+        writer = csv.DictWriter(f, table_columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def write_svg(file_out, floorplans, rows, dbu=0.001, width=1200):
+    '''
+    SVG overview of the chip, width pixels wide.
+    floorplans: [pya.Polygon] of the framework and UBC, in database units
+    rows: [dict with table_columns], positions and sizes in um
+    '''
+    bbox = pya.DBox()
+    for polygon in floorplans:
+        bbox += polygon.bbox().to_dtype(dbu)
+    for row in rows:
+        bbox += pya.DBox(row['x'], row['y'], row['x'] + row['width'], row['y'] + row['height'])
+    if bbox.empty():
+        bbox = pya.DBox(0, 0, 1, 1)
+
+    # SVG y axis points down
+    def point(x, y):
+        return '%.3f,%.3f' % (x - bbox.left, bbox.top - y)
+
+    lines = ['<svg xmlns="http://www.w3.org/2000/svg" width="%s" height="%s" viewBox="0 0 %.3f %.3f">'
+             % (width, int(width * bbox.height() / bbox.width()), bbox.width(), bbox.height()),
+             '<rect width="100%" height="100%" fill="white"/>']
+    stroke = max(bbox.width(), bbox.height()) / 2000
+    for polygon in floorplans:
+        points = ' '.join(point(p.x * dbu, p.y * dbu) for p in polygon.each_point_hull())
+        lines.append('<polygon points="%s" fill="#dddddd" stroke="#888888" stroke-width="%.3f"/>' % (points, stroke))
+    for i, row in enumerate(rows):
+        x, y = point(row['x'], row['y'] + row['height']).split(',')
+        lines.append('<rect x="%s" y="%s" width="%.3f" height="%.3f" fill="%s" fill-opacity="0.6" stroke="%s" stroke-width="%.3f">'
+                     % (x, y, row['width'], row['height'], course_colors.get(row['course'], '#bab0ac'),
+                        'red' if row['clipped'] else 'black', stroke * (4 if row['clipped'] else 1)))
+        lines.append('<title>%s</title></rect>' % html.escape('%s: %s at %s, %s' % (row['file'], row['cell'], row['x'], row['y'])))
+        lines.append('<text x="%.3f" y="%.3f" font-size="%.3f" font-family="sans-serif">%s</text>'
+                     % (float(x) + stroke * 10, float(y) + row['height'] / 4, min(row['height'] / 5, row['width'] / 8), i + 1))
+    lines.append('</svg>')
+    with open(file_out, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
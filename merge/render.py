@@ -0,0 +1,236 @@
+'''
+Chip preview rendering for the automated merge (EBeam_merge.py)
+
+Renders the merged layout file in tiles, and stitches them into EBeam.png:
+ - the tiles are rendered in worker processes (EBeam_merge.py --jobs N),
+   each with its own LayoutView of the layout file
+ - level of detail: cells smaller than lod_pixels are drawn as their
+   bounding box on each layer
+ - tiles are cached, by the hash of the cells placed in them (the
+   normalized submission cache keys), the render settings and the
+   versions of KLayout and of the PDK, which sets the layer properties,
+   so only the tiles that changed are rendered again
+ - optionally, a zoomable tile pyramid: folder/{z}/{x}/{y}.png, with
+   tiles.json describing the levels
+
+The view is configured as SiEPIC's cell.image(), without the ruler,
+which would be drawn in every tile.
+
+'''
+
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version, PackageNotFoundError
+
+import pya
+
+from normalized_cache import klayout_version
+
+# Increment when the rendering changes
+render_version = 1
+
+_view = None
+
+
+def pdk_versions():
+    '''Versions of SiEPIC-Tools and the PDK, for the tile cache key'''
+    versions = {}
+    for package in ['SiEPIC', 'siepic_ebeam_pdk']:
+        try:
+            versions[package] = version(package)
+        except PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def simplify_small_cells(layout, size):
+    '''
+    Replace the contents of the cells smaller than size (um) in both
+    dimensions by their bounding box on each layer
+    '''
+    small = []
+    for cell in layout.each_cell():
+        bbox = cell.dbbox()
+        if not bbox.empty() and bbox.width() < size and bbox.height() < size:
+            small.append((cell, [(li, cell.bbox_per_layer(li)) for li in layout.layer_indexes()]))
+    for cell, boxes in small:
+        cell.clear()
+        for li, box in boxes:
+            if box.area() > 0:
+                cell.shapes(li).insert(box)
+    return len(small)
+
+
+def open_view(file_in, tech_name, lod_size=0):
+    '''
+    LayoutView of the top cell in file_in, with the technology's layer
+    properties; cells smaller than lod_size (um) are simplified
+    '''
+    view = pya.LayoutView()
+    view.load_layout(file_in, tech_name, True)
+    cell_view = view.cellview(0)
+    if lod_size > 0:
+        simplify_small_cells(cell_view.layout(), lod_size)
+    view.load_layer_props(pya.Technology.technology_by_name(tech_name).eff_layer_properties_file())
+    view.set_config("text-font", 3)
+    view.set_config("background-color", "#ffffff")
+    view.set_config("text-visible", "true")
+    view.set_config("grid-show-ruler", "false")
+    view.max_hier()
+    return view
+
+
+def _init_worker(file_in, tech_name, lod_size):
+    global _view
+    _view = open_view(file_in, tech_name, lod_size)
+
+
+def render_tile(tile):
+    '''Pixels of tile (box, width, height), as PixelBuffer.to_bytes()'''
+    box, width, height = tile
+    return _view.get_pixels_with_options(width, height, 0, 0, 0, pya.DBox(*box)).to_bytes()
+
+
+def tile_grid(bbox, pixel_size, width, height, tile_size):
+    '''
+    Tiles covering width x height pixels of pixel_size (um), from the top
+    left corner of bbox (DBox): [(column, row, (left, bottom, right, top), w, h)]
+    '''
+    tiles = []
+    for row in range(math.ceil(height / tile_size)):
+        for column in range(math.ceil(width / tile_size)):
+            w = min(tile_size, width - column * tile_size)
+            h = min(tile_size, height - row * tile_size)
+            left = bbox.left + column * tile_size * pixel_size
+            top = bbox.top - row * tile_size * pixel_size
+            tiles.append((column, row, (left, top - h * pixel_size, left + w * pixel_size, top), w, h))
+    return tiles
+
+
+def tile_key(settings, box, width, height, items, margin):
+    '''
+    Cache key for a tile, from the items placed in it, or None if one of
+    them has no key.  items: [(DBox in um, key)]; margin: um around the tile
+    '''
+    search = pya.DBox(*box).enlarged(margin, margin)
+    placed = []
+    for item_box, key in items:
+        if item_box.touches(search):
+            if key is None:
+                return None
+            placed.append((item_box.to_s(), key))
+    h = hashlib.sha256()
+    h.update(json.dumps([settings, box, width, height, sorted(placed)]).encode())
+    return h.hexdigest()
+
+
+def render_tiles(file_in, tech_name, tiles, pixel_size, jobs=1, lod_pixels=2, items=None, cache_folder=None, used=None):
+    '''
+    Render tiles [(column, row, box, w, h)] of the layout in file_in.
+    Returns {(column, row): PixelBuffer}.  Tiles found in cache_folder
+    are not rendered again; used collects the cache keys.
+    '''
+    lod_size = lod_pixels * pixel_size
+    settings = [render_version, klayout_version(), pdk_versions(), tech_name, lod_pixels, pixel_size]
+
+    pixels = {}
+    todo = []
+    for column, row, box, w, h in tiles:
+        key = None
+        if items is not None and cache_folder:
+            key = tile_key(settings, box, w, h, items, 64 * pixel_size)
+        if key:
+            used.add(key)
+            file_tile = os.path.join(cache_folder, key + '.png')
+            if os.path.exists(file_tile):
+                try:
+                    pixels[(column, row)] = pya.PixelBuffer.read_png(file_tile)
+                    continue
+                except RuntimeError:
+                    pass
+        todo.append((column, row, box, w, h, key))
+
+    if todo:
+        tiles_todo = [(box, w, h) for column, row, box, w, h, key in todo]
+        if jobs > 1 and len(todo) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('fork'),
+                                     initializer=_init_worker, initargs=(file_in, tech_name, lod_size)) as executor:
+                results = list(executor.map(render_tile, tiles_todo))
+        else:
+            _init_worker(file_in, tech_name, lod_size)
+            results = [render_tile(tile) for tile in tiles_todo]
+        for (column, row, box, w, h, key), data in zip(todo, results):
+            pixels[(column, row)] = pya.PixelBuffer.from_bytes(data)
+            if key:
+                os.makedirs(cache_folder, exist_ok=True)
+                pixels[(column, row)].write_png(os.path.join(cache_folder, key + '.png'))
+    return pixels
+
+
+def stitch(tiles, pixels, width, height, tile_size):
+    '''Single PixelBuffer from the tiles'''
+    data = bytearray(8 + width * height * 4)
+    struct.pack_into('<II', data, 0, width, height)
+    for column, row, box, w, h in tiles:
+        tile = pixels[(column, row)].to_bytes()
+        for r in range(h):
+            o = 8 + ((row * tile_size + r) * width + column * tile_size) * 4
+            data[o:o + w * 4] = tile[8 + r * w * 4:8 + (r + 1) * w * 4]
+    return pya.PixelBuffer.from_bytes(bytes(data))
+
+
+def pixel_grid(bbox, width, dbu=0.001):
+    '''Pixel size (um, a multiple of dbu) and height in pixels for an image width pixels wide'''
+    pixel_size = math.ceil(bbox.width() / width / dbu) * dbu
+    return pixel_size, math.ceil(bbox.height() / pixel_size)
+
+
+def render_png(file_in, file_out, bbox, tech_name='EBeam', dbu=0.001, width=1600, tile_size=512, jobs=1,
+               lod_pixels=2, items=None, cache_folder=None, pyramid_folder=None, pyramid_levels=6):
+    '''
+    Render the top cell of the layout in file_in to the PNG file_out,
+    width pixels wide, and optionally a tile pyramid with pyramid_levels
+    levels into pyramid_folder.
+
+    bbox: DBox of the top cell, in um
+    items: [(DBox in um, key)] for every cell placed on the chip, with the
+      key of its content, for the tile cache; None to disable the cache
+    '''
+    used = set()
+
+    # a margin around the chip, as LayoutView.zoom_fit()
+    margin = 0.025 * max(bbox.width(), bbox.height())
+    bbox = bbox.enlarged(margin, margin)
+
+    pixel_size, height = pixel_grid(bbox, width, dbu)
+    tiles = tile_grid(bbox, pixel_size, width, height, tile_size)
+    pixels = render_tiles(file_in, tech_name, tiles, pixel_size, jobs, lod_pixels, items, cache_folder, used)
+    stitch(tiles, pixels, width, height, tile_size).write_png(file_out)
+
+    if pyramid_folder:
+        # level z is 256 * 2^z pixels across the larger dimension of the chip
+        levels = []
+        size = max(bbox.width(), bbox.height())
+        for z in range(pyramid_levels):
+            pixel_size = math.ceil(size / (256 * 2**z) / dbu) * dbu
+            level_width, level_height = math.ceil(bbox.width() / pixel_size), math.ceil(bbox.height() / pixel_size)
+            tiles = tile_grid(bbox, pixel_size, level_width, level_height, 256)
+            pixels = render_tiles(file_in, tech_name, tiles, pixel_size, jobs, lod_pixels, items, cache_folder, used)
+            for column, row, box, w, h in tiles:
+                folder = os.path.join(pyramid_folder, str(z), str(column))
+                os.makedirs(folder, exist_ok=True)
+                pixels[(column, row)].write_png(os.path.join(folder, '%s.png' % row))
+            levels.append({'z': z, 'pixel_size': pixel_size, 'width': level_width, 'height': level_height})
+        with open(os.path.join(pyramid_folder, 'tiles.json'), 'w') as f:
+            json.dump({'tile_size': 256, 'bbox': [bbox.left, bbox.bottom, bbox.right, bbox.top], 'levels': levels}, f, indent=1)
+
+    # the cache holds the tiles of the last render
+    if cache_folder and os.path.exists(cache_folder):
+        for p in os.listdir(cache_folder):
+            if p.endswith('.png') and p[:-4] not in used:
+                os.remove(os.path.join(cache_folder, p))
@@ -1,11 +1,8 @@
 import pya
-from pya import *
-import SiEPIC
-from SiEPIC.verification import layout_check
-from SiEPIC.scripts import zoom_out
 from SiEPIC.utils import get_technology_by_name
 import siepic_ebeam_pdk
 import os
+import re
 import sys
 """
 Script to load .gds file passed in through commmand line and run submission checks:
@@ -34,6 +31,12 @@ bb_cells = [
         'ebeam_dream_splitter_1x2_te1550_BB',
 ]
 
+# An allowed BB cell: one of the names, or the name followed by '$' and a
+# suffix, as KLayout appends when merging layouts.  The alternatives are
+# tried in order, so a cell matches the first of bb_cells, e.g.,
+# GC_TM_1310_8degOxide_BB$1 matches GC_TM_1310_8degOxide_BB.
+bb_pattern = re.compile(r'(?:%s)(?:\$.*)?' % '|'.join('(%s)' % re.escape(name) for name in bb_cells), re.S)
+
 
 # gds file to run verification on
 if len(sys.argv) > 1:
@@ -50,8 +53,6 @@ print('')
 print('Running submission checks for file %s' % gds_file)
 
 
-from SiEPIC.scripts import replace_cell, cells_containing_bb_layers    
-
 import xml.etree.ElementTree as ET
 
 def extract_sources_from_xml(file_path):
@@ -72,6 +73,46 @@ def extract_sources_from_xml(file_path):
     return sources
 
 
+def black_box_cells(top_cell, bb_layerinfo=pya.LayerInfo(998,0)):
+   """
+   Black box cells of the layout, in one pass over the cells, without
+   changing the layout; the same as replacing each of bb_cells in turn by
+   an empty cell (SiEPIC.scripts.replace_cell), then looking for the
+   shapes left on the BB layer (cells_containing_bb_layers):
+    - the number of instances of the allowed BB cells (bb_pattern), for
+      each name in bb_cells that has any
+    - the names of the cells with shapes on bb_layerinfo, in top_cell,
+      other than in the allowed BB cells
+   """
+   layout = top_cell.layout()
+
+   # allowed BB cells, and their instances
+   allowed = set()
+   counts = {}
+   for cell in layout.each_cell():
+      match = bb_pattern.fullmatch(cell.name)
+      if match:
+         allowed.add(cell.cell_index())
+         name = bb_cells[match.lastindex - 1]
+         counts[name] = counts.get(name, 0) + sum(1 for inst in cell.each_parent_inst())
+
+   # the other cells in top_cell, with BB shapes
+   cells_bb = set()
+   layer_bb = layout.find_layer(bb_layerinfo)
+   if layer_bb is not None:
+      todo = [top_cell.cell_index()]
+      visited = set(todo)
+      while todo:
+         cell = layout.cell(todo.pop())
+         if not cell.shapes(layer_bb).is_empty():
+            cells_bb.add(cell.name)
+         for ci in cell.each_child_cell():
+            if ci not in visited and ci not in allowed:
+               visited.add(ci)
+               todo.append(ci)
+
+   return [(name, counts[name]) for name in bb_cells if counts.get(name)], sorted(cells_bb)
+
 
 def check():
    
@@ -145,28 +186,16 @@ def check():
          num_errors += 1
 
 
-      # Check black box cells, by replacing them with an empty cell, 
-      # then checking if there are any BB geometries left over
-      dummy_layout = pya.Layout()
-      dummy_cell = dummy_layout.create_cell("dummy_cell")
-      dummy_file = "dummy_cell.gds"
-      dummy_cell.write(dummy_file)
+      # Check black box cells: the allowed BB cells are as if replaced
+      # with an empty cell, then check if there are any BB geometries left over
       bb_count = 0
       print ('Performing Black Box cell replacement check')
-      for i in range(len(bb_cells)):
-         text_out, count, error = replace_cell(layout, 
-               cell_x_name = bb_cells[i], 
-               cell_y_name = dummy_cell.name, 
-               cell_y_file = dummy_file, 
-               Exact = False, RequiredCharacter='$',
-               run_layout_diff = False,
-               debug = False,)
-         if count and count > 0:
-            bb_count += count
-            print(' - black box cell: %s' % bb_cells[i])
+      bb_instances, cells_bb = black_box_cells(top_cell, bb_layerinfo=pya.LayerInfo(998,0))
+      for name, count in bb_instances:
+         bb_count += count
+         print(' - black box cell: %s' % name)
       print (' - Number of black box cells to be replaced: %s' % bb_count)
 
-      cells_bb = cells_containing_bb_layers(top_cell, BB_layerinfo=pya.LayerInfo(998,0), verbose=False)
       print(' - Number of unreplaced BB cells: %s' % len(cells_bb))
       if len(cells_bb) > 0:
          print(' - Names of unreplaced BB cells: %s' % set(cells_bb))
@@ -1,39 +1,76 @@
-import pya
-from pya import *
-import SiEPIC
-from SiEPIC.verification import layout_check
-from SiEPIC.scripts import zoom_out
-from SiEPIC.utils import get_technology_by_name
-import siepic_ebeam_pdk
+import klayout.db as pya
 import os
 import sys
+import json
+import shutil
+import time
+import multiprocessing
+import multiprocessing.connection
+import tempfile
+import traceback
+import re
+import signal
+from klayout.rdb import ReportDatabase, RdbItemValue
+from verification_cache import VerificationCache, cell_hashes
+try:
+   import resource
+except ImportError:
+   # not available on Windows
+   resource = None
 """
 Script to load .gds file passed in through commmand line and run verification using layout_check().
 Ouput lyrdb file is saved to path specified by 'file_lyrdb' variable in the script.
 
-Jasmina Brar 12/08/23, and Lukas Chrostowski
+Batch mode, to verify several files, loading the technology once:
+   python run_verification.py --batch submissions/a.gds submissions/b.oas
+   git diff --name-only ... | python run_verification.py --batch -
+   python run_verification.py --batch --jobs 0 --timeout 1200 --json verification.json submissions/*
+Each file is verified on its own, in a process forked from this one, with
+up to --jobs files at a time (0: one per CPU): an error, a crash, or a file
+running past --timeout seconds or --memory MB does not stop the others.
+The output of each file is printed when it is done.  A summary is printed
+at the end, one line per file, and the total number of errors last;
+--json writes the results: for each file, the number of errors, the
+lyrdb file, the runtime and the peak memory.
 
-"""
+The results are cached in .cache/verification, by the geometry of the
+layout and the tool versions (verification_cache.py): a file verified
+before returns the stored number of errors and lyrdb report.  Use
+--no-cache to verify every file.
 
-# gds file to run verification on
-gds_file = sys.argv[1]
+Per-circuit mode, to verify a large layout on several CPUs:
+   python run_verification.py --split --jobs 0 submissions/EBeam_anthonyreiter.gds
+The top-level instances and opt_in labels of the top cell are split into
+groups of circuits so that no check involves two groups: touching
+instances, each opt_in label and its nearest grating coupler, and grating
+couplers closer than the minimum spacing, are in the same group.  Each
+group is checked by layout_check in its own cell, in forked processes, up
+to --jobs at a time, and the reports are merged into one lyrdb file, with
+the same errors as checking the top cell.  With --batch, the files are
+then verified one at a time.
 
-print('')
-print('')
-print('')
-print('')
-print('Running SiEPIC-Tools automated verification for file %s' % gds_file)
+Supervised mode, with --timeout, --memory, or --progress, also for one file:
+   python run_verification.py --timeout 600 --memory 4000 --progress - submissions/a.gds
+Each file is verified in a worker process, in a process group with the
+processes it starts, stopped as a whole (SIGTERM, then SIGKILL) when over
+the time or memory limit.  The worker prints the end of each stage (the
+timing of layout_check: nets and components, DFT, pins, ...), from which
+the supervisor writes the progress events to --progress, as JSON lines:
+start, progress every --progress-interval seconds (time, memory, last
+stage done), and end (the result, with the time of each stage).  For a
+file stopped, the output says after which stage, and --json records the
+time of each stage.
 
-try:
-   # load into layout
-   layout = pya.Layout()
-   layout.read(gds_file)
-except:
-   print('Error loading layout')
-   num_errors = 1
+SiEPIC-Tools and the PDK take most of the start-up time (and SiEPIC checks
+PyPI for a newer version when imported), so they are imported when the
+first layout is verified (technology()): --help, and files found in the
+cache, do not load them.  benchmarks/startup.py measures the start-up
+time of the scripts.
 
+Jasmina Brar 12/08/23, and Lukas Chrostowski
+
+"""
 
-import klayout.db as pya
 
 def top_cell_with_most_subcells_or_shapes(layout):
    """
@@ -73,33 +110,827 @@ def top_cell_with_most_subcells_or_shapes(layout):
 #     print(f"Top cell with most subcells/shapes: {top_cell.name}")
 
 
-try:
-   # get top cell from layout
-   top_cell = top_cell_with_most_subcells_or_shapes(layout)
-   
-   if not top_cell:
-      print('No top cell in the layout')
-   else:
-      print('Top cell: %s' % top_cell.name)
+# technology, loaded once for all the files
+TECHNOLOGY = None
+
+def technology():
+   """
+   The EBeam technology, loaded on first use, with SiEPIC-Tools and the
+   PDK: before the worker processes are forked, so that they share them
+   """
+   global TECHNOLOGY
+   if TECHNOLOGY is None:
+      import siepic_ebeam_pdk
+      from SiEPIC.utils import get_technology_by_name
+      TECHNOLOGY = get_technology_by_name('EBeam')
+   return TECHNOLOGY
+
+def print_timing(stage, start_time):
+   """
+   Print the end of a stage of the verification, in the format of
+   layout_check(timing=True), for the supervisor (timing_stages)
+   """
+   print('*** verification, timing; %s' % stage)
+   print('    Time elapsed: %s' % (time.time() - start_time))
 
-   # set layout technology because the technology seems to be empty, and we cannot load the technology using TECHNOLOGY = get_technology() because this isn't GUI mode
-   # refer to line 103 in layout_check()
-   # tech = layout.technology()
-   # print("Tech:", tech.name)
-   layout.TECHNOLOGY = get_technology_by_name('EBeam')
+# stages printed by print_timing and layout_check(timing=True)
+timing_pattern = re.compile(r'^\*\*\* (verification|layout_check\(\)), timing; (.*?)\s*\n\s*Time elapsed: ([0-9.e+-]+)', re.M)
+
+def timing_stages(log):
+   """
+   The stages done, from the output of verify(timing=True): a list of
+   [stage, seconds from the start of the verification]; the times of
+   layout_check are from its own start, after the last stage of verify
+   """
+   stages = []
+   offset = 0
+   for source, stage, elapsed in timing_pattern.findall(log):
+      elapsed = float(elapsed)
+      if source == 'verification':
+         offset = elapsed
+      else:
+         elapsed += offset
+      stages.append([stage, round(elapsed, 3)])
+   return stages
 
+def lyrdb_file(gds_file):
+   """Output lyrdb file for gds_file"""
    # get file path, filename, path for output lyrdb file
    path = os.path.dirname(os.path.realpath(__file__))
    filename = gds_file.split(".")[0]
-   file_lyrdb = os.path.join(path,filename+'.lyrdb')
+   return os.path.join(path,filename+'.lyrdb')
+
+def box_distance(a, b):
+   """Distance between the boxes a and b, along x or y, whichever is larger; 0 if they touch"""
+   return max(0, a.left - b.right, b.left - a.right, a.bottom - b.top, b.bottom - a.top)
+
+
+def circuit_groups(cell, gc_distance=0, gc_names=()):
+   """
+   Split the content of cell into groups of circuits, for verify_circuits,
+   so that each check of layout_check is within a group:
+    - the top-level instances containing components (DevRec) or labels are
+      grouped when they touch (overlapping components, connected pins)
+    - with each opt_in label, the component with an optical IO nearest to
+      it, which layout_check takes as its grating coupler
+    - and the grating couplers (gc_names, the cell names in the DFT rules)
+      within gc_distance of each other
+   The other instances and shapes join the nearest group.  A cell wrapping
+   a single instance is looked through.
+   Returns (cell, trans, groups, common): the cell holding the circuits,
+   its transformation in cell, the groups as lists of instances and shapes,
+   and the shapes for all the groups (Floorplan, and the labels other than
+   opt_in); groups is empty if the cell cannot be split.
+   """
+   layout = cell.layout()
+   layer_devrec = layout.find_layer(TECHNOLOGY['DevRec'])
+   layer_fbrtgt = layout.find_layer(TECHNOLOGY['FbrTgt'])
+   layer_text = layout.find_layer(TECHNOLOGY['Text'])
+   layer_floorplan = layout.find_layer(TECHNOLOGY['FloorPlan'])
+   if layer_devrec is None:
+      return cell, pya.ICplxTrans(), [], []
+
+   # the design, in a cell holding a single instance of it
+   trans = pya.ICplxTrans()
+   while cell.child_instances() == 1 and all(cell.shapes(li).is_empty() for li in layout.layer_indexes()):
+      inst = next(cell.each_inst())
+      if inst.is_regular_array() or not inst.cell.shapes(layer_devrec).is_empty():
+         break
+      trans = trans * inst.cplx_trans
+      cell = inst.cell
+   if not cell.shapes(layer_devrec).is_empty():
+      return cell, trans, [], []
+
+   # the components with an optical IO (FbrTgt polygon) and the grating
+   # couplers, at the origin of the cell with the DevRec shape, as found by
+   # find_components; and the opt_in labels, in the hierarchy of an instance
+   def has_fbrtgt(c):
+      iter1 = c.begin_shapes_rec(layer_fbrtgt)
+      while not iter1.at_end():
+         if iter1.shape().is_polygon():
+            return True
+         iter1.next()
+      return False
+   io_cells = set(c.cell_index() for c in layout.each_cell()
+                  if layer_fbrtgt is not None and not c.shapes(layer_devrec).is_empty() and has_fbrtgt(c))
+   gc_cells = set(c.cell_index() for c in layout.each_cell() if c.basic_name().startswith(tuple(gc_names)))
+   def points(inst):
+      gcs, ios, labels = [], [], []
+      for t in inst.cell_inst.each_cplx_trans():
+         iter1 = inst.cell.begin_shapes_rec(layer_devrec)
+         while not iter1.at_end():
+            if not iter1.shape().is_text():
+               point = (t * iter1.trans()).disp.to_p()
+               if iter1.cell_index() in gc_cells:
+                  gcs.append(point)
+               if iter1.cell_index() in io_cells:
+                  ios.append(point)
+            iter1.next()
+         if layer_text is not None:
+            iter1 = inst.cell.begin_shapes_rec(layer_text)
+            while not iter1.at_end():
+               if iter1.shape().is_text() and iter1.shape().text_string.find('opt') > -1:
+                  labels.append(iter1.shape().text.transformed(t * iter1.trans()).position())
+               iter1.next()
+      return gcs, ios, labels
 
-   # run verification
-   num_errors = layout_check(cell = top_cell, verbose=False, GUI=True, file_rdb=file_lyrdb)
+   # the items grouped (anchors): (box, item, has components, grating couplers, IOs, labels); and the others
+   anchors, others, common = [], [], []
+   layers = [li for li in layout.layer_indexes() if li != layer_floorplan]
+   for inst in cell.each_inst():
+      box = pya.Box()
+      for li in layers:
+         box += inst.bbox(li)
+      has_devrec = not inst.bbox(layer_devrec).empty()
+      if has_devrec or (layer_text is not None and not inst.bbox(layer_text).empty()):
+         anchors.append((box, inst, has_devrec) + points(inst))
+      else:
+         others.append((box if not box.empty() else inst.bbox(), inst))
+   for li in layout.layer_indexes():
+      for shape in cell.shapes(li).each():
+         if li == layer_floorplan or (li == layer_text and shape.is_text() and shape.text_string.find('opt') == -1):
+            common.append(shape)
+         elif li == layer_text and shape.is_text():
+            anchors.append((shape.bbox(), shape, False, [], [], [shape.text.position()]))
+         else:
+            others.append((shape.bbox(), shape))
 
-except:
-   print('Unknown error occurred')
-   num_errors = 1
+   # group the anchors, using a grid of bins
+   group_of = list(range(len(anchors)))
+   def find(i):
+      while group_of[i] != i:
+         group_of[i] = group_of[group_of[i]]
+         i = group_of[i]
+      return i
+   def union(i, j):
+      group_of[find(i)] = find(j)
+   bin_size = int(100 / layout.dbu)
+   def link(items, distance):
+      """group the anchors of the boxes in items, a list of (box, anchor), within distance"""
+      size = max(2 * distance, bin_size)
+      bins = {}
+      for box, i in items:
+         enlarged = box.enlarged(pya.Vector(distance, distance))
+         for bx in range(enlarged.left // size, enlarged.right // size + 1):
+            for by in range(enlarged.bottom // size, enlarged.top // size + 1):
+               for box2, j in bins.setdefault((bx, by), []):
+                  if find(i) != find(j) and box_distance(box, box2) <= distance:
+                     union(i, j)
+               bins[(bx, by)].append((box, i))
+   link([(box, i) for i, (box, item, has_devrec, gcs, ios, labels) in enumerate(anchors) if isinstance(item, pya.Instance)], 0)
+   link([(pya.Box(point, point), i) for i, anchor in enumerate(anchors) for point in anchor[3]], gc_distance)
+
+   # each label with the nearest IO, searching the bins around it ring by ring
+   io_bins = {}
+   for i, anchor in enumerate(anchors):
+      for point in anchor[4]:
+         io_bins.setdefault((point.x // bin_size, point.y // bin_size), []).append((point, i))
+   num_ios = sum(len(anchor[4]) for anchor in anchors)
+   for i, anchor in enumerate(anchors):
+      for label in anchor[5]:
+         bx, by = label.x // bin_size, label.y // bin_size
+         found, ring, seen = [], 0, 0
+         while seen < num_ios and not (found and found[0][0] < (ring - 1) * bin_size):
+            for x in range(bx - ring, bx + ring + 1):
+               for y in range(by - ring, by + ring + 1):
+                  if max(abs(x - bx), abs(y - by)) == ring:
+                     for point, j in io_bins.get((x, y), ()):
+                        seen += 1
+                        found.append((label.distance(point), j))
+            found.sort()
+            ring += 1
+         # all the IOs at the shortest distance, as the nearest one depends on the order of the components
+         for d, j in found:
+            if d == found[0][0]:
+               union(i, j)
+
+   groups = {}
+   for i, anchor in enumerate(anchors):
+      groups.setdefault(find(i), []).append(anchor)
+
+   # the groups with components, and the others joining the nearest one
+   circuits, loose = [], []
+   for group in groups.values():
+      box = pya.Box()
+      for anchor in group:
+         box += anchor[0]
+      entry = {'box': box, 'items': [anchor[1] for anchor in group]}
+      (circuits if any(anchor[2] for anchor in group) else loose).append(entry)
+   if not circuits:
+      return cell, trans, [], []
+   def nearest(box):
+      return min(circuits, key=lambda circuit: box_distance(box, circuit['box']))
+   for entry in loose:
+      nearest(entry['box'])['items'] += entry['items']
+   for box, item in others:
+      nearest(box)['items'].append(item)
+   return cell, trans, [circuit['items'] for circuit in circuits], common
+
+
+def check_circuit(cell, file_rdb, log_file):
+   """layout_check on cell, in a forked process, with its output in log_file"""
+   from SiEPIC.verification import layout_check
+   sys.stdout.flush()
+   sys.stderr.flush()
+   fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+   os.dup2(fd, 1)
+   os.dup2(fd, 2)
+   layout_check(cell = cell, verbose=False, GUI=True, file_rdb=file_rdb)
+   sys.stdout.flush()
+
+
+def merge_reports(rdb_files, file_lyrdb, cell):
+   """
+   Merge the lyrdb reports of the circuits of cell into file_lyrdb.
+   The opt_in labels are checked for duplicates over the whole cell, as
+   by layout_check, in place of the checks within each circuit.
+   Returns the number of errors.
+   """
+   from SiEPIC.utils import find_automated_measurement_labels
+   rdbs = []
+   for f in rdb_files:
+      rdb = ReportDatabase('')
+      rdb.load(f)
+      rdbs.append(rdb)
+   merged = ReportDatabase(rdbs[0].name)
+   merged.description = rdbs[0].description
+   merged.generator = rdbs[0].generator
+   merged.top_cell_name = cell.name
+   rdb_cell = merged.create_cell(cell.name)
+
+   # the categories, in the order of layout_check
+   categories = {}
+   def copy_categories(parent, source):
+      for category in source:
+         new = merged.create_category(parent, category.name()) if parent else merged.create_category(category.name())
+         new.description = category.description
+         categories[category.path()] = (new, [])
+         copy_categories(new, category.each_sub_category())
+   copy_categories(None, rdbs[0].each_category())
+
+   optin_same = next((path for path, (category, items) in categories.items() if category.name() == 'opt_in label: same'), None)
+   for rdb in rdbs:
+      for item in rdb.each_item():
+         path = rdb.category_by_id(item.category_id()).path()
+         if path != optin_same:
+            categories[path][1].append(list(item.each_value()))
+
+   # opt_in labels check for unique, as in layout_check
+   if optin_same:
+      dbu = cell.layout().dbu
+      text_out, opt_in = find_automated_measurement_labels(cell, TECHNOLOGY=TECHNOLOGY)
+      for ti1 in range(0, len(opt_in)):
+         if 'opt_in' in opt_in[ti1]:
+            t = opt_in[ti1]['Text']
+            box_s = 1000
+            box = pya.Box(t.x - box_s, t.y - box_s, t.x + box_s, t.y + box_s)
+            for ti2 in range(ti1 + 1, len(opt_in)):
+               if 'opt_in' in opt_in[ti2] and opt_in[ti1]['opt_in'] == opt_in[ti2]['opt_in']:
+                  categories[optin_same][1].append([RdbItemValue(t.string), RdbItemValue(pya.Polygon(box).to_dtype(dbu))])
+
+   for category, items in categories.values():
+      for values in items:
+         rdb_item = merged.create_item(rdb_cell.rdb_id(), category.rdb_id())
+         for value in values:
+            rdb_item.add_value(value)
+   merged.save(file_lyrdb)
+
+   # as printed by layout_check
+   if merged.num_items() > 0:
+      print("%s layout errors detected.  \nPlease review errors using the 'Marker Database Browser'." % merged.num_items())
+      for e in merged.each_item():
+         print('Error: %s: %s' % (merged.category_by_id(e.category_id()).name(), merged.category_by_id(e.category_id()).description))
+   return merged.num_items()
+
+
+def verify_circuits(top_cell, file_lyrdb, jobs=1, cache=None, hashes=None, start_time=None):
+   """
+   Run layout_check on the groups of circuits of top_cell (circuit_groups),
+   each in a cell of its own, in forked processes, up to jobs at a time,
+   and merge the reports into file_lyrdb.  A cell that cannot be split is
+   checked as a whole.
+   cache: VerificationCache; the groups verified before, in this layout or
+   a previous version of it, are taken from the cache.
+   hashes: cell_hashes of the layout, if known
+   start_time: start of the verification, to print the progress
+   (print_timing), or None
+   Returns the number of errors, and the work done: a dict with the number
+   of groups and components, and how many were from the cache; or None if
+   the cell was checked as a whole.
+   """
+   from SiEPIC.verification import layout_check
+   from SiEPIC.utils import load_DFT
+   layout = top_cell.layout()
+
+   # circuits closer than the design-for-test distances are checked together:
+   # opt_in label to the nearest grating coupler, and grating coupler spacing
+   DFT = load_DFT(TECHNOLOGY=TECHNOLOGY, topcell=top_cell)
+   gc_distance, gc_names = 0, ()
+   if DFT:
+      gc_distance = float(DFT['design-for-test']['grating-couplers'].get('minimum-gc-spacing', 0)) / layout.dbu
+      gc_names = DFT['design-for-test']['grating-couplers']['gc-orientation'].keys()
+   cell, trans, groups, common = circuit_groups(top_cell, int(gc_distance) + 1, gc_names)
+   if start_time:
+      print_timing('split into %s groups of circuits' % len(groups), start_time)
+   if len(groups) < 2:
+      print('Verifying the top cell as a whole')
+      return layout_check(cell = top_cell, verbose=False, GUI=True, timing=start_time is not None, file_rdb=file_lyrdb), None
+
+   # a cell for each group, with the labels for the DFT rules
+   dft_labels = []
+   layer_text = layout.find_layer(TECHNOLOGY['Text'])
+   if layer_text is not None:
+      iter1 = top_cell.begin_shapes_rec(layer_text)
+      iter1.min_depth = 1
+      while not iter1.at_end():
+         if iter1.shape().is_text() and iter1.shape().text_string.find('DFT=') > -1:
+            dft_labels.append(iter1.shape().text.transformed(iter1.itrans()))
+         iter1.next()
+   cells = []
+   for items in groups:
+      circuit = layout.create_cell('%s_circuit%s' % (top_cell.name, len(cells) + 1))
+      for item in items + common:
+         if isinstance(item, pya.Instance):
+            circuit.insert(item.cell_inst.transformed(trans))
+         else:
+            circuit.shapes(item.layer).insert(item, trans)
+      for text in dft_labels:
+         circuit.shapes(layer_text).insert(text)
+      cells.append(circuit)
+
+   folder = tempfile.mkdtemp(prefix='verification_circuits_')
+   rdb_files = [os.path.join(folder, '%s.lyrdb' % i) for i in range(len(cells))]
+   try:
+      # the groups verified before, unchanged
+      todo = list(zip(cells, rdb_files))
+      keys = {}
+      if cache:
+         if hashes is None:
+            hashes = cell_hashes(layout)
+         for circuit, rdb_file in list(todo):
+            keys[rdb_file] = cache.circuit_key(circuit, hashes)
+            if cache.get(keys[rdb_file], rdb_file) is not None:
+               todo.remove((circuit, rdb_file))
+
+      # the work skipped, in components (DevRec shapes)
+      layer_devrec = layout.find_layer(TECHNOLOGY['DevRec'])
+      components = dict((circuit.cell_index(), pya.Region(circuit.begin_shapes_rec(layer_devrec)).count()) for circuit in cells)
+      stats = {'groups': len(cells), 'groups_cached': len(cells) - len(todo),
+         'components': sum(components.values()),
+         'components_cached': sum(components.values()) - sum(components[circuit.cell_index()] for circuit, rdb_file in todo)}
+      fork = 'fork' in multiprocessing.get_all_start_methods()
+      if not fork and jobs > 1:
+         # processes started with "spawn" would not have the layout
+         print('Verifying the circuits in parallel requires the "fork" start method; verifying them one at a time in this process')
+         jobs = 1
+      print('Verifying %s of %s groups of circuits, %s at a time; %s from the cache (%s of %s components)' % (len(todo), len(cells), jobs,
+         stats['groups_cached'], stats['components_cached'], stats['components']))
+
+      num_todo = len(todo)
+      if not fork:
+         for i, (circuit, rdb_file) in enumerate(todo):
+            layout_check(cell = circuit, verbose=False, GUI=True, file_rdb=rdb_file)
+            if start_time:
+               print_timing('verified %s of %s groups of circuits' % (i + 1, num_todo), start_time)
+      else:
+         context = multiprocessing.get_context('fork')
+         running = {}
+         try:
+            while todo or running:
+               while todo and len(running) < jobs:
+                  circuit, rdb_file = todo.pop(0)
+                  process = context.Process(target=check_circuit, args=(circuit, rdb_file, rdb_file + '.log'))
+                  process.start()
+                  running[process.sentinel] = (circuit, process)
+               for sentinel in multiprocessing.connection.wait(list(running)):
+                  circuit, process = running.pop(sentinel)
+                  process.join()
+                  if process.exitcode != 0:
+                     raise Exception('verification of %s stopped with exit code %s' % (circuit.name, process.exitcode))
+                  if start_time:
+                     print_timing('verified %s of %s groups of circuits' % (num_todo - len(todo) - len(running), num_todo), start_time)
+         finally:
+            # on an error, stop the other circuits before their cells and folder are deleted
+            for circuit, process in running.values():
+               process.terminate()
+            for circuit, process in running.values():
+               process.join(5)
+               if process.exitcode is None:
+                  process.kill()
+                  process.join()
+
+      if cache:
+         for rdb_file, key in keys.items():
+            rdb = ReportDatabase('')
+            rdb.load(rdb_file)
+            cache_put(cache, key, rdb.num_items(), rdb_file)
+      return merge_reports(rdb_files, file_lyrdb, top_cell), stats
+   finally:
+      for circuit in cells:
+         layout.delete_cell(circuit.cell_index())
+      shutil.rmtree(folder)
+
+
+def cache_put(cache, *args):
+   """
+   cache.put(*args); a result that cannot be stored is only a warning,
+   as the file was verified
+   """
+   try:
+      cache.put(*args)
+   except OSError as e:
+      print('Warning: the verification result was not stored in the cache: %s' % e)
 
-# Print the result value to standard output
-print(num_errors)
 
+def verify(gds_file, cache=None, split=None, timing=False):
+   """
+   Run layout_check on the file, and save the lyrdb file next to it.
+   cache: VerificationCache, for the results of the layouts verified before
+   split: number of processes to verify the circuits of the file separately
+   (verify_circuits), or None to verify the top cell as a whole
+   timing: print the progress, the time at the end of each stage, for
+   the supervisor (verify_files)
+   Returns the number of errors, whether it is from the cache, and the
+   work done by verify_circuits (or None); errors loading or checking the
+   file count as 1.
+   """
+   print('')
+   print('')
+   print('')
+   print('')
+   print('Running SiEPIC-Tools automated verification for file %s' % gds_file)
+   start_time = time.time()
+
+   # the same file verified before
+   if cache:
+      num_errors = cache.get_file(gds_file, lyrdb_file(gds_file))
+      if num_errors is not None:
+         print('Verification result from the cache: %s errors' % num_errors)
+         return num_errors, True, None
+
+   try:
+      # load into layout
+      layout = pya.Layout()
+      layout.read(gds_file)
+   except Exception as e:
+      print('Error loading layout: %s' % e)
+      return 1, False, None
+   if timing:
+      print_timing('loaded %s cells' % layout.cells(), start_time)
+
+   # the same layout verified before, e.g., saved again
+   key, hashes = None, None
+   if cache:
+      hashes = cell_hashes(layout)
+      key = cache.key(layout, hashes)
+      num_errors = cache.get(key, lyrdb_file(gds_file))
+      if num_errors is not None:
+         print('Verification result from the cache: %s errors' % num_errors)
+         cache_put(cache, key, num_errors, lyrdb_file(gds_file), gds_file)
+         return num_errors, True, None
+      if timing:
+         print_timing('looked up the layout in the cache', start_time)
+
+   try:
+      # get top cell from layout
+      top_cell = top_cell_with_most_subcells_or_shapes(layout)
+      
+      if not top_cell:
+         print('No top cell in the layout')
+      else:
+         print('Top cell: %s' % top_cell.name)
+
+      # set layout technology because the technology seems to be empty, and we cannot load the technology using TECHNOLOGY = get_technology() because this isn't GUI mode
+      # refer to line 103 in layout_check()
+      # tech = layout.technology()
+      # print("Tech:", tech.name)
+      layout.TECHNOLOGY = technology()
+
+      # path for output lyrdb file
+      file_lyrdb = lyrdb_file(gds_file)
+
+      # run verification
+      circuits = None
+      if split:
+         num_errors, circuits = verify_circuits(top_cell, file_lyrdb, split, cache, hashes, start_time if timing else None)
+         if timing:
+            print_timing('merged the reports', start_time)
+      else:
+         from SiEPIC.verification import layout_check
+         num_errors = layout_check(cell = top_cell, verbose=False, GUI=True, timing=timing, file_rdb=file_lyrdb)
+
+      if cache:
+         cache_put(cache, key, num_errors, file_lyrdb, gds_file)
+
+   except Exception:
+      print('Unknown error occurred')
+      traceback.print_exc(file=sys.stdout)
+      num_errors, circuits = 1, None
+
+   return num_errors, False, circuits
+
+
+def peak_rss():
+   """Peak resident memory of this process, in kB, or None if unknown"""
+   if resource is None:
+      return None
+   rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   # bytes on macOS, kB on Linux
+   return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def process_rss(pid):
+   """
+   Memory of the process pid and of the processes it started, in its
+   process group, in kB, or None if unknown (Linux only): the proportional
+   set size, so that the pages shared after a fork count once; or the
+   resident memory of pid, if not available
+   """
+   total = None
+   for p in os.listdir('/proc'):
+      if not p.isdigit():
+         continue
+      try:
+         with open('/proc/%s/stat' % p) as f:
+            # the fields after the command name, which may contain spaces
+            fields = f.read().rsplit(')', 1)[1].split()
+         if int(fields[2]) != pid:
+            continue
+         with open('/proc/%s/smaps_rollup' % p) as f:
+            for line in f:
+               if line.startswith('Pss:'):
+                  total = (total or 0) + int(line.split()[1])
+      except (OSError, ValueError, IndexError):
+         continue
+   if total is not None:
+      return total
+   try:
+      with open('/proc/%s/statm' % pid) as f:
+         return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+   except (OSError, ValueError, IndexError):
+      return None
+
+
+def stop_process(process, grace=5):
+   """
+   Stop the worker process and the processes it started: SIGTERM, for it
+   to clean up, e.g., the temporary files of verify_circuits, then SIGKILL
+   after grace seconds
+   """
+   try:
+      os.killpg(process.pid, signal.SIGTERM)
+   except OSError:
+      # not in a process group of its own yet
+      process.terminate()
+   process.join(grace)
+   try:
+      os.killpg(process.pid, signal.SIGKILL)
+   except OSError:
+      pass
+   if process.exitcode is None:
+      process.kill()
+      process.join()
+
+
+def verify_worker(gds_file, connection, log_file, cache, split):
+   """
+   Verify the file in a forked process, with its output and progress in
+   log_file, and send the number of errors and the peak memory to
+   connection.  The process and the processes it starts are in a process
+   group of their own, stopped together by stop_process.
+   """
+   os.setpgrp()
+   signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+   sys.stdout.flush()
+   sys.stderr.flush()
+   fd = os.open(log_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+   os.dup2(fd, 1)
+   os.dup2(fd, 2)
+   # each line as printed, for the progress
+   sys.stdout.reconfigure(line_buffering=True)
+   num_errors, cached, circuits = verify(gds_file, cache, split, timing=True)
+   sys.stdout.flush()
+   connection.send({'errors': num_errors, 'cached': cached, 'circuits': circuits, 'rss_kB': peak_rss()})
+
+
+def verify_files(gds_files, jobs=1, timeout=None, memory=None, cache=None, memory_interval=0.5, split=None,
+                 progress=None, progress_interval=10):
+   """
+   Verify each file, in a forked process, up to jobs at a time.
+   timeout: seconds per file; memory: memory per file, in MB, with the
+   processes it starts, checked every memory_interval seconds (on Linux).
+   A file over its limit is stopped with stop_process.
+   cache: VerificationCache; the files seen before are not verified again
+   split: verify the circuits of each file in up to split processes
+   (verify_circuits), the files one at a time
+   progress: file for the progress events, as JSON lines: start, progress
+   every progress_interval seconds (seconds, memory, last stage done),
+   and end (the result)
+   Without the "fork" start method, the files are verified in this
+   process, one at a time, without the limits or the progress events
+   other than start and end.
+   Returns the results, in order: a dict for each file with file, status
+   (ok, timeout, memory, or crashed), errors (1 if the file did not
+   finish), cached, circuits (the work done by verify_circuits), lyrdb,
+   seconds, rss_kB, and stages: [stage, seconds], where the time went
+   (timing_stages), and the time after the last stage for a file stopped.
+   """
+   def event(name, **fields):
+      if progress:
+         progress.write(json.dumps(dict(event=name, time=round(time.time(), 3), **fields)) + '\n')
+         progress.flush()
+
+   if 'fork' not in multiprocessing.get_all_start_methods():
+      # worker processes started with "spawn" would not share the technology
+      print('Parallel mode requires the "fork" start method; running the files in this process')
+      if timeout or memory:
+         print('The limits per file (--timeout, --memory) are not enforced without the "fork" start method')
+      if progress:
+         print('Only the start and end events are written to --progress without the "fork" start method')
+      results = []
+      for gds_file in gds_files:
+         start_time = time.time()
+         event('start', file=gds_file)
+         num_errors, cached, circuits = verify(gds_file, cache, split)
+         results.append({'file': gds_file, 'status': 'ok', 'errors': num_errors, 'cached': cached, 'circuits': circuits,
+            'lyrdb': lyrdb_file(gds_file) if os.path.exists(lyrdb_file(gds_file)) else None,
+            'seconds': time.time() - start_time, 'rss_kB': peak_rss(), 'stages': []})
+         event('end', **results[-1])
+      return results
+
+   context = multiprocessing.get_context('fork')
+   log_folder = tempfile.mkdtemp(prefix='verification_')
+   todo = list(enumerate(gds_files))
+   running = {}
+   results = [None] * len(gds_files)
+   next_progress = time.time() + progress_interval
+   while todo or running:
+      while todo and len(running) < jobs:
+         i, gds_file = todo.pop(0)
+         event('start', file=gds_file)
+
+         # the files seen before, without starting a process
+         start_time = time.time()
+         num_errors = cache.get_file(gds_file, lyrdb_file(gds_file)) if cache else None
+         if num_errors is not None:
+            print('')
+            print('Verification result for file %s from the cache: %s errors' % (gds_file, num_errors))
+            results[i] = {'file': gds_file, 'status': 'ok', 'errors': num_errors, 'cached': True, 'circuits': None,
+               'lyrdb': lyrdb_file(gds_file) if os.path.exists(lyrdb_file(gds_file)) else None,
+               'seconds': time.time() - start_time, 'rss_kB': None, 'stages': []}
+            event('end', **results[i])
+            continue
+
+         # load the technology once, before forking
+         technology()
+         receiver, sender = context.Pipe(duplex=False)
+         log_file = os.path.join(log_folder, '%s.log' % i)
+         open(log_file, 'w').close()
+         process = context.Process(target=verify_worker, args=(gds_file, sender, log_file, cache, split))
+         process.start()
+         sender.close()
+         running[process.sentinel] = (i, gds_file, process, receiver, log_file, time.time())
+
+      if not running:
+         continue
+
+      # wait for a file to finish, the next timeout, memory check, or progress event
+      wait = memory_interval if memory else None
+      if timeout:
+         wait = min(wait or timeout, max(0, min(start_time + timeout for i, gds_file, process, receiver, log_file, start_time in running.values()) - time.time()))
+      if progress:
+         wait = min(wait or progress_interval, max(0, next_progress - time.time()))
+      finished = multiprocessing.connection.wait(list(running), timeout=wait)
+
+      if progress and time.time() >= next_progress:
+         for i, gds_file, process, receiver, log_file, start_time in running.values():
+            with open(log_file, errors='replace') as f:
+               stages = timing_stages(f.read())
+            event('progress', file=gds_file, seconds=round(time.time() - start_time, 3), rss_kB=process_rss(process.pid),
+               stage=stages[-1][0] if stages else None)
+         next_progress = time.time() + progress_interval
+
+      for sentinel in list(running):
+         i, gds_file, process, receiver, log_file, start_time = running[sentinel]
+         if sentinel in finished:
+            process.join()
+            result = receiver.recv() if receiver.poll() else None
+            status = 'ok' if result else 'crashed'
+         elif timeout and time.time() - start_time >= timeout:
+            status = 'timeout'
+         elif memory and (process_rss(process.pid) or 0) > memory * 1024:
+            status = 'memory'
+         else:
+            continue
+         seconds = time.time() - start_time
+         if status in ['timeout', 'memory']:
+            stop_process(process)
+            result = None
+         del running[sentinel]
+         receiver.close()
+
+         # output of the file, in one piece, and where the time went
+         with open(log_file, errors='replace') as f:
+            log = f.read()
+         sys.stdout.write(log)
+         os.remove(log_file)
+         stages, last = [], 0
+         for stage, elapsed in timing_stages(log):
+            stages.append([stage, round(elapsed - last, 3)])
+            last = elapsed
+         if status == 'timeout':
+            print('Error: verification of %s stopped after %s seconds' % (gds_file, timeout))
+         elif status == 'memory':
+            print('Error: verification of %s stopped, using more than %s MB' % (gds_file, memory))
+         elif status == 'crashed':
+            print('Error: verification of %s stopped with exit code %s' % (gds_file, process.exitcode))
+         if status != 'ok':
+            print(' - %.1f seconds after the last stage done: %s' % (seconds - last, stages[-1][0] if stages else 'none'))
+            stages.append(['stopped', round(seconds - last, 3)])
+         sys.stdout.flush()
+
+         results[i] = {'file': gds_file, 'status': status, 'errors': result['errors'] if result else 1,
+            'cached': result['cached'] if result else False, 'circuits': result['circuits'] if result else None,
+            'lyrdb': lyrdb_file(gds_file) if result and os.path.exists(lyrdb_file(gds_file)) else None,
+            'seconds': seconds, 'rss_kB': result['rss_kB'] if result else None, 'stages': stages}
+         event('end', **results[i])
+   os.rmdir(log_folder)
+   return results
+
+
+def verify_batch(gds_files, jobs=1, timeout=None, memory=None, cache=None, json_file=None, split=None, progress=None, progress_interval=10):
+   """
+   Verify each file with verify_files, print a summary, and write the
+   results to json_file.
+   Returns the total number of errors.
+   """
+   start_time = time.time()
+   results = verify_files(gds_files, 1 if split else jobs, timeout, memory, cache, split=split,
+      progress=progress, progress_interval=progress_interval)
+   num_errors = sum(result['errors'] for result in results)
+
+   print('')
+   print('Verification summary, %s files:' % len(results))
+   for result in results:
+      circuits = result['circuits']
+      print(' - %s errors: %s%s' % (result['errors'], result['file'],
+         ' (cached)' if result['cached'] else
+         ' (%s of %s groups of circuits cached)' % (circuits['groups_cached'], circuits['groups']) if circuits else
+         '' if result['status'] == 'ok' else ' (%s)' % result['status']))
+
+   if json_file:
+      with open(json_file, 'w') as f:
+         json.dump({'jobs': jobs, 'timeout': timeout, 'memory_MB': memory, 'cached': sum(result['cached'] for result in results), 'errors': num_errors,
+            'seconds': time.time() - start_time, 'files': results}, f, indent=1)
+   return num_errors
+
+
+if __name__ == "__main__":
+   import argparse
+   parser = argparse.ArgumentParser(description='SiEPIC-Tools automated verification of layout files')
+   parser.add_argument('files', nargs='*', help='gds/oas files; with --batch, "-" or none to read them from stdin')
+   parser.add_argument('--batch', action='store_true', help='verify several files, and print a summary')
+   parser.add_argument('--jobs', type=int, default=1, help='files verified at a time, with --batch, or circuits with --split; 0: one per CPU')
+   parser.add_argument('--timeout', type=float, default=None, help='seconds per file')
+   parser.add_argument('--memory', type=int, default=None, help='memory per file in MB, with the processes it starts (Linux)')
+   parser.add_argument('--progress', default=None, help='file for the progress events, as JSON lines; "-" for stderr')
+   parser.add_argument('--progress-interval', type=float, default=10, help='seconds between the progress events')
+   parser.add_argument('--json', default=None, help='JSON file for the results, with --batch')
+   parser.add_argument('--split', action='store_true', help='verify the groups of circuits of each file in parallel, and merge the reports')
+   parser.add_argument('--no-cache', action='store_true', help='do not use the cache of verification results')
+   parser.add_argument('--cache-size', type=int, default=200, help='maximum size of the cache of verification results, in MB')
+   args = parser.parse_args()
+
+   # Cache of the verification results, to only verify new or changed layouts
+   cache = None
+   if not args.no_cache:
+      path = os.path.dirname(os.path.realpath(__file__))
+      cache = VerificationCache(os.path.join(path, '.cache', 'verification'), max_size=args.cache_size*1024*1024, script=__file__)
+
+   progress = None
+   if args.progress:
+      progress = sys.stderr if args.progress == '-' else open(args.progress, 'a')
+
+   jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+   if args.batch:
+      # files from the command line, or one per line from stdin
+      gds_files = args.files
+      if not gds_files or gds_files == ['-']:
+         gds_files = [line.strip() for line in sys.stdin if line.strip()]
+      num_errors = verify_batch(gds_files, jobs, args.timeout, args.memory, cache, args.json, split=jobs if args.split else None,
+         progress=progress, progress_interval=args.progress_interval)
+   else:
+      # gds file to run verification on
+      if len(args.files) != 1:
+         parser.error('one file to verify, or use --batch')
+      gds_file = args.files[0]
+      if args.timeout or args.memory or progress:
+         # supervised, in a worker process
+         results = verify_files([gds_file], 1, args.timeout, args.memory, cache, split=jobs if args.split else None,
+            progress=progress, progress_interval=args.progress_interval)
+         num_errors = results[0]['errors']
+      else:
+         num_errors, cached, circuits = verify(gds_file, cache, split=jobs if args.split else None)
+
+   # Print the result value to standard output
+   print(num_errors)
@@ -0,0 +1,243 @@
+"""
+On-disk cache of verification results, for run_verification.py
+
+Each entry holds the number of errors found by layout_check for one
+layout, or one group of circuits of a layout (<key>.json), and its lyrdb
+report (<key>.lyrdb).  The key is a hash of:
+ - the geometry of the layout, in a canonical form (geometry_hash), so
+   the same design saved again, or as GDS rather than OASIS, is a hit
+ - the KLayout, SiEPIC and siepic_ebeam_pdk versions, and the
+   verification script
+
+As the geometry hash needs the layout to be read, the hash of the file
+content is also kept (<file key>.key), pointing to the entry: a file
+seen before is a hit without reading it.
+
+With run_verification.py --split, each group of circuits is an entry of
+its own, keyed by its content (circuit_key): a layout changed in a few
+places, e.g., one waveguide rerouted, re-checks only the groups of
+circuits with changed cells, and takes the others from the cache.
+
+When the cache grows beyond max_size, the least recently used entries
+are removed.
+
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from importlib.metadata import version, PackageNotFoundError
+
+import klayout.db as pya
+
+# Increment when the format of the entries changes
+cache_version = 1
+
+
+def tool_versions():
+   """Versions of the tools used by the verification"""
+   versions = {'klayout': getattr(pya, '__version__', None)}
+   # from the package metadata, without importing SiEPIC and the PDK
+   for package in ['SiEPIC', 'siepic_ebeam_pdk']:
+      try:
+         versions[package] = version(package)
+      except PackageNotFoundError:
+         versions[package] = None
+   return versions
+
+
+def cell_hash(cell, hashes, layers, name=True):
+   """
+   Hash of the cell, independent of the file format and of the order of
+   the shapes: its name (unless name is False), shapes per layer (boxes as
+   polygons, paths, texts by string and position), and instances by the
+   hash of their cell, from hashes.  layers: sorted (layer name, index)
+   """
+   h = hashlib.sha256(cell.name.encode() if name else b'')
+   for layer_name, li in layers:
+      shapes = cell.shapes(li)
+      if shapes.is_empty():
+         continue
+      items = []
+      for shape in shapes.each():
+         if shape.is_text():
+            items.append('text %s %s' % (shape.text_string, shape.text_pos))
+         elif shape.is_path():
+            items.append(shape.path.to_s())
+         elif shape.is_box() or shape.is_polygon() or shape.is_simple_polygon():
+            items.append(shape.polygon.to_s())
+      h.update(layer_name.encode())
+      for item in sorted(items):
+         h.update(item.encode())
+   for item in sorted('%s %s %s %s %s %s' % (hashes[inst.cell_index], inst.cplx_trans, inst.a, inst.b, inst.na, inst.nb)
+                      for inst in cell.each_inst()):
+      h.update(item.encode())
+   return h.hexdigest()
+
+
+def layers(layout):
+   """The layers of the layout, for cell_hash"""
+   return sorted((layout.get_info(li).to_s(), li) for li in layout.layer_indexes())
+
+
+def cell_hashes(layout):
+   """cell_hash of each cell of the layout, by cell index"""
+   hashes = {}
+   layout_layers = layers(layout)
+   for ci in layout.each_cell_bottom_up():
+      hashes[ci] = cell_hash(layout.cell(ci), hashes, layout_layers)
+   return hashes
+
+
+def geometry_hash(layout, hashes=None):
+   """
+   Hash of the layout, independent of the file format and of the order of
+   the cells and shapes: the cell_hash of its top cells.
+   hashes: cell_hashes(layout), if known
+   """
+   hashes = hashes or cell_hashes(layout)
+   h = hashlib.sha256(('%s' % layout.dbu).encode())
+   for cell_hash in sorted(hashes[cell.cell_index()] for cell in layout.top_cells()):
+      h.update(cell_hash.encode())
+   return h.hexdigest()
+
+
+class VerificationCache:
+   """
+   Cache of (number of errors, lyrdb report) from layout_check
+   """
+
+   def __init__(self, folder, max_size=200*1024*1024, script=None):
+      self.folder = folder
+      self.max_size = max_size
+      os.makedirs(folder, exist_ok=True)
+
+      # tool versions and verification code
+      h = hashlib.sha256()
+      h.update(('%s %s' % (cache_version, json.dumps(tool_versions(), sort_keys=True))).encode())
+      if script:
+         with open(script, 'rb') as fh:
+            h.update(fh.read())
+      self.tools_hash = h.hexdigest()
+
+   def key(self, layout, hashes=None):
+      """Cache key for the layout; hashes: cell_hashes(layout), if known"""
+      return hashlib.sha256((self.tools_hash + geometry_hash(layout, hashes)).encode()).hexdigest()
+
+   def circuit_key(self, cell, hashes):
+      """
+      Cache key for a group of circuits of run_verification.verify_circuits,
+      in cell: its content, whatever its name; hashes: cell_hashes of the
+      cells it instantiates
+      """
+      layout = cell.layout()
+      h = cell_hash(cell, hashes, layers(layout), name=False)
+      return hashlib.sha256(('%s circuit %s %s' % (self.tools_hash, layout.dbu, h)).encode()).hexdigest()
+
+   def file_key(self, f):
+      """Key of the file content"""
+      h = hashlib.sha256()
+      h.update(self.tools_hash.encode())
+      with open(f, 'rb') as fh:
+         for chunk in iter(lambda: fh.read(1024*1024), b''):
+            h.update(chunk)
+      return h.hexdigest()
+
+   def _paths(self, key):
+      return os.path.join(self.folder, key + '.json'), os.path.join(self.folder, key + '.lyrdb')
+
+   def get(self, key, file_lyrdb):
+      """
+      Number of errors for key, with the lyrdb report copied to
+      file_lyrdb, or None on a miss
+      """
+      file_json, file_rdb = self._paths(key)
+      try:
+         with open(file_json) as fh:
+            entry = json.load(fh)
+         if entry['lyrdb']:
+            shutil.copyfile(file_rdb, file_lyrdb)
+         num_errors = entry['errors']
+      except (OSError, ValueError, KeyError, TypeError):
+         self.remove(key)
+         return None
+      # mark as recently used, unless another process evicted it since
+      try:
+         os.utime(file_json)
+      except OSError:
+         pass
+      return num_errors
+
+   def get_file(self, f, file_lyrdb):
+      """get() for the file f, if its content was seen before, or None"""
+      try:
+         with open(os.path.join(self.folder, self.file_key(f) + '.key')) as fh:
+            key = fh.read().strip()
+      except OSError:
+         return None
+      return self.get(key, file_lyrdb)
+
+   def put(self, key, num_errors, file_lyrdb, f=None):
+      """
+      Store the result for key, and the key of the file f, then evict
+      entries beyond max_size.  The files are written under names of
+      this process, then renamed, as the workers of run_verification.py
+      --batch share the cache
+      """
+      file_json, file_rdb = self._paths(key)
+      tmp = '.%s.tmp' % os.getpid()
+      has_lyrdb = file_lyrdb is not None and os.path.exists(file_lyrdb)
+      if has_lyrdb:
+         shutil.copyfile(file_lyrdb, file_rdb + tmp)
+         os.replace(file_rdb + tmp, file_rdb)
+      # write the entry last, so that an interrupted write is a miss
+      with open(file_json + tmp, 'w') as fh:
+         json.dump({'errors': num_errors, 'lyrdb': has_lyrdb}, fh)
+      os.replace(file_json + tmp, file_json)
+      if f:
+         file_key = os.path.join(self.folder, self.file_key(f) + '.key')
+         with open(file_key + tmp, 'w') as fh:
+            fh.write(key)
+         os.replace(file_key + tmp, file_key)
+      self.evict()
+
+   def remove(self, key):
+      for p in self._paths(key):
+         try:
+            os.remove(p)
+         except FileNotFoundError:
+            pass
+
+   def evict(self):
+      """
+      Remove the least recently used entries until the cache fits in
+      max_size; the entries removed meanwhile by other processes are skipped
+      """
+      entries = []
+      for p in os.listdir(self.folder):
+         if p.endswith('.json'):
+            file_json, file_rdb = self._paths(p[:-5])
+            try:
+               size = os.path.getsize(file_json) + (os.path.getsize(file_rdb) if os.path.exists(file_rdb) else 0)
+               entries.append((os.path.getmtime(file_json), size, p[:-5]))
+            except OSError:
+               pass
+      entries.sort()
+      size = sum(e[1] for e in entries)
+      removed = set()
+      while entries and size > self.max_size:
+         _, s, key = entries.pop(0)
+         self.remove(key)
+         removed.add(key)
+         size -= s
+      # and the file keys pointing to them
+      if removed:
+         for p in os.listdir(self.folder):
+            if p.endswith('.key'):
+               try:
+                  with open(os.path.join(self.folder, p)) as fh:
+                     if fh.read().strip() in removed:
+                        os.remove(os.path.join(self.folder, p))
+               except OSError:
+                  pass